@@ -1,5 +1,7 @@
 from typing import *
 import logging
+import pickle
+from concurrent.futures import ProcessPoolExecutor
 
 from clingo.ast import *
 from clingo.control import *
@@ -7,8 +9,12 @@ from clingo.symbol import *
 from clingo.solving import *
 
 from .pysolver.preprocess import preprocess
-from .pysolver.utils import parse_line
-from .pysolver import get_proof_tree
+from .pysolver.utils import parse_line, flip_sign
+from .pysolver import get_proof_tree, CompiledProgram, JustificationTree, SolverBudget, BudgetExceeded, InfiniteRegress, OrParallel
+from .pysolver.term import to_term
+from .pysolver.rule_cache import rule_cache
+from .pysolver.clingo_backend import clingo_verdicts, dependent_predicates
+from .pysolver.rule_index import get_atom_key
 
 def asp_parse_program(terms: List[str]):
     success = []
@@ -16,7 +22,7 @@ def asp_parse_program(terms: List[str]):
     for term in terms:
         # Parsing.
         try:
-            parsed_program.extend(preprocess(parse_line(term['asp']))) # Unpack pooling and #count aggregates, negated heads to constraints, ...
+            parsed_program.extend(rule_cache.get(term['asp']).preprocessed) # Unpack pooling and #count aggregates, negated heads to constraints, ... (cached)
         except Exception as e:
             success.append({
                 'code': 10,
@@ -31,6 +37,23 @@ def asp_parse_program(terms: List[str]):
     assert len(terms) == len(success)
     return parsed_program, success
 
+def asp_compile_program(terms: List[Dict[str, Any]], reorder_body=False, materialize=False):
+    # Same as `asp_parse_program`, but also compiles the program for the solver (see `asp_run`)
+    program = CompiledProgram(terms, reorder_body=reorder_body, materialize=materialize)
+    success = []
+    for error in program.errors:
+        if error is not None:
+            success.append({
+                'code': 10,
+                'msg': "Syntax error " + str(error)
+            })
+        else:
+            success.append({
+                'code': 0,
+                'msg': "Success"
+            })
+    return program, success
+
 def asp_reformat_str(term: str, skip_if_fail=False) -> str:
     """Produce reparsible, reformattable string.
     Assumes that
@@ -46,14 +69,10 @@ def asp_reformat_str(term: str, skip_if_fail=False) -> str:
     # if term, it ends with a period.
     try:
         if term.strip().endswith('.'):
-            result = []
-            parse_string(term, result.append)
-            return str(result[1])
+            return str(rule_cache.get(term).ast)
         # else, add a period, parse, and remove the period.
         else:
-            result = []
-            parse_string(term + ".", result.append)
-            return str(result[1]).replace('.', '').strip()
+            return str(rule_cache.get(term + ".").ast).replace('.', '').strip()
     except Exception as e:
         if skip_if_fail:
             return term
@@ -150,57 +169,191 @@ def asp_extract_pred_arg_list(term: str, exclude_underscore:bool = True):
     #     return []
     return pred_arg_list
 
-def asp_run(program: List[Dict[str, Any]], conc_symbols: List[AST], output_style="html"):
-    proofs = []
-    flag_success = True
-    for conc_symbol in conc_symbols:
-        # logging.debug(conc_symbol)
-        tree = get_proof_tree(program, conc_symbol)
+def _asp_format_tree(tree: JustificationTree, output_style: str) -> Union[str, Dict[str, Any]]:
+    if output_style == "json":
+        return tree.to_json() # drawn by the client
+    tree = str(tree)
+    # HTML specific formatting
+    if output_style == "html":
+        tree = tree.replace("\n", " <br>")
+        tree = tree.replace(" ", "&nbsp;")
+    return tree
+
+def _asp_prove_conclusion(program: CompiledProgram, conclusion: str, conc_symbol, output_style: str, proof_limit: int, budget: SolverBudget, or_parallel: OrParallel = None) -> Tuple[Optional[Dict[str, Any]], bool]:
+    # Prove a conclusion; if it fails, explain with its negation or `#false`.
+    # Returns (proof entry or None, proved)
+    try:
+        tree = program.get_proof_tree(conc_symbol, limit=proof_limit, budget=budget, parallel=or_parallel)
+        if not tree and budget is not None and budget.exceeded is not None:
+            return {
+                "conclusion": conclusion,
+                "proved": 0,
+                "tree": f"Solver budget exceeded: {budget.exceeded}"
+            }, False
+        if tree:
+            return {
+                "conclusion": conclusion,
+                "proved": 1,
+                "tree": _asp_format_tree(tree, output_style)
+            }, True
+
+        new_conc_symbol = flip_sign(conc_symbol) # `not x` <-> `x`
+        tree = program.get_proof_tree(new_conc_symbol, limit=proof_limit, budget=budget, parallel=or_parallel)
+        if not tree:
+            false_proof = program.prove_false(budget) # cached
+            tree = JustificationTree([false_proof]) if false_proof is not None else None
         if tree:
-            tree = str(tree)
-            # HTML specific formatting
-            if output_style == "html":
-                tree = tree.replace("\n", " <br>")
-                tree = tree.replace(" ", "&nbsp;")
-            proofs.append({
+            return {
+                "conclusion": conclusion,
+                "proved": 0,
+                "tree": _asp_format_tree(tree, output_style)
+            }, False
+        return None, False
+    except InfiniteRegress as e:
+        # Reported like an exceeded budget: `p :- not q. q :- not p.` has no answer for this conclusion
+        return {
+            "conclusion": conclusion,
+            "proved": 0,
+            "tree": str(e)
+        }, False
+
+def _asp_merge_verdicts(conc_symbols: List[AST], verdicts: List[Optional[bool]], results: Iterator, explain: bool):
+    # Results of every conclusion, in order: clingo verdicts, with trees from the pysolver `results` where computed.
+    # A conclusion proved by pysolver stays proved (its tree is a proof).
+    for conc_symbol, verdict in zip(conc_symbols, verdicts):
+        if verdict is True and not explain:
+            yield {
                 "conclusion": str(conc_symbol),
                 "proved": 1,
-                "tree": tree
-            })
-        else:
-            if conc_symbol.startswith("not "):
-                new_conc_symbol = conc_symbol.replace("not ", "")
-            else:
-                new_conc_symbol = "not " + conc_symbol
-            tree = get_proof_tree(program, new_conc_symbol)
+                "tree": ""
+            }, True
+            continue
+        entry, proved = next(results)
+        if proved:
+            if verdict is False:
+                logging.warning(f"clingo does not derive {conc_symbol}, proved by pysolver")
+        elif verdict is not None:
+            proved = verdict
+            if entry is not None:
+                entry["proved"] = int(verdict)
+        yield entry, proved
+
+# Worker processes for `asp_run(..., workers=n)`, kept while requests share the program (e.g. the same case again)
+_executor: ProcessPoolExecutor = None
+_executor_key: Tuple[int, str] = None # (workers, program fingerprint)
+_worker_program: CompiledProgram = None # set in each worker by `_init_worker`
+
+def _get_executor(workers: int, program: CompiledProgram) -> ProcessPoolExecutor:
+    # Each worker receives the program once, when it starts; a pool serves a single program
+    global _executor, _executor_key
+    key = (workers, program.context.fingerprint)
+    if _executor is None or _executor_key != key:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(pickle.dumps(program),))
+        _executor_key = key
+    return _executor
+
+def _init_worker(program_bytes: bytes):
+    global _worker_program
+    _worker_program = pickle.loads(program_bytes)
+
+def _asp_prove_conclusion_worker(conclusion: str, conc_symbol, output_style: str, proof_limit: int, budget: SolverBudget):
+    entry, proved = _asp_prove_conclusion(_worker_program, conclusion, conc_symbol, output_style, proof_limit, budget)
+    return entry, proved, budget
+
+def _asp_clingo_verdicts(program: CompiledProgram, conc_symbols: List[AST], budget: SolverBudget = None) -> List[Optional[bool]]:
+    # Verdicts of every conclusion in one clingo call (None: left to pysolver)
+    deadline = None
+    if budget is not None:
+        budget.start()
+        deadline = budget.deadline
+    lines = []
+    dropped = []
+    for line, error in zip(program.program, program.errors):
+        if error is None:
+            # The rules pysolver gets (numeric strings converted, unpooled), without duals; directives as written
+            parsed = rule_cache.get(line["asp"])
+            if len(parsed.rules) == 0:
+                lines.append(line["asp"])
+                continue
+            statements, complete = parsed.clingo # aggregates unpacked, unsafe rules dropped
+            lines.extend(statements)
+            if not complete:
+                dropped.append(get_atom_key(parsed.terms[0].head.atom))
+    undecided = dependent_predicates(program.context.rule_index.rules, dropped) # left to pysolver
+    return clingo_verdicts(lines, [to_term(conc_symbol) for conc_symbol in conc_symbols], deadline, undecided)
+
+def asp_run(program: Union[List[Dict[str, Any]], CompiledProgram], conc_symbols: List[AST], output_style="html", proof_limit=1, budget: SolverBudget = None, workers: int = None, or_parallel: OrParallel = None, backend="pysolver", explain=False):
+    # program: rules, or a program compiled by `asp_compile_program` (compiled once per request)
+    # output_style: format of each "tree": "html" (text tree as HTML), "json" (nested nodes, see `JustificationTree.to_json`),
+    #   or anything else for the plain text tree. Messages (budget exceeded, ...) are always strings.
+    # proof_limit: number of proofs merged into each justification tree (None: every proof)
+    # budget: resource limits shared by every conclusion; on exhaustion, remaining conclusions are reported unproved
+    # workers: prove conclusions in parallel with this many processes (None/0: one after another).
+    #   Each conclusion then gets its own copy of `budget` (limits apply per conclusion; usage is summed).
+    # or_parallel: try alternative rules of shallow goals in parallel (see `OrParallel`); not used together with `workers`
+    # backend: "clingo" decides every conclusion with a single clingo call (see `clingo_verdicts`);
+    #   pysolver then only builds trees for conclusions that do not hold (or every conclusion, with `explain`),
+    #   and proves the conclusions clingo cannot decide. Proved conclusions without a tree get an empty tree.
+    assert backend in ["pysolver", "clingo"]
+    proofs = []
+    flag_success = True
+    # Shared by every query, so that the program is compiled and checked for consistency (`#false`) once
+    if not isinstance(program, CompiledProgram):
+        program = CompiledProgram(program)
+
+    verdicts = [None] * len(conc_symbols)
+    if backend == "clingo":
+        verdicts = _asp_clingo_verdicts(program, conc_symbols, budget)
+    all_conc_symbols = conc_symbols
+    conc_symbols = [
+        conc_symbol for conc_symbol, verdict in zip(all_conc_symbols, verdicts)
+        if verdict is not True or explain
+    ] # need pysolver
+
+    results = None
+    if workers and len(conc_symbols) > 1:
+        if budget is not None:
+            budget.start()
+        try:
+            program.prove_false(budget) # check once, before the program is sent to workers
+        except (BudgetExceeded, InfiniteRegress):
+            pass # reported per conclusion
+        if budget is None or budget.exceeded is None:
+            executor = _get_executor(workers, program)
+            futures = [
+                executor.submit(
+                    _asp_prove_conclusion_worker,
+                    str(conc_symbol), to_term(conc_symbol), output_style, proof_limit,
+                    budget.fork() if budget is not None else None
+                )
+                for conc_symbol in conc_symbols
+            ]
+            results = []
+            for future in futures: # original order
+                entry, proved, worker_budget = future.result()
+                if budget is not None:
+                    budget.merge(worker_budget)
+                results.append((entry, proved))
+    if results is None:
+        results = (
+            _asp_prove_conclusion(program, str(conc_symbol), conc_symbol, output_style, proof_limit, budget, or_parallel)
+            for conc_symbol in conc_symbols
+        )
+
+    if backend == "clingo":
+        results = _asp_merge_verdicts(all_conc_symbols, verdicts, iter(results), explain)
+    for entry, proved in results:
+        if not proved:
             flag_success = False
-            if tree:
-                tree = str(tree)
-                # HTML specific formatting
-                if output_style == "html":
-                    tree = tree.replace("\n", " <br>")
-                    tree = tree.replace(" ", "&nbsp;")
-                proofs.append({
-                    "conclusion": str(conc_symbol),
-                    "proved": 0,
-                    "tree": tree
-                })
-            else:
-                tree = get_proof_tree(program, parse_line("#false.").head)
-                flag_success = False
-                if tree:
-                    tree = str(tree)
-                    # HTML specific formatting
-                    if output_style == "html":
-                        tree = tree.replace("\n", " <br>")
-                        tree = tree.replace(" ", "&nbsp;")
-                    proofs.append({
-                        "conclusion": str(conc_symbol),
-                        "proved": 0,
-                        "tree": tree
-                    })
-
-    return {
+        if entry is not None:
+            proofs.append(entry)
+
+    result = {
         "satisfactory": "Satisfied" if flag_success else "Unsatisfied",
         "proofs": proofs
-    }
\ No newline at end of file
+    }
+    if budget is not None:
+        result["budget"] = budget.stats() # `exceeded` is not None if the result is partial
+    return result
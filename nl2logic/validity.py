@@ -2,8 +2,25 @@
 from .logic_utils import *
 from .database_utils import *
 from .utils import *
+from .config import nl2logic_config as config
 
-def validity_check(data, mode):
+_or_parallel = None
+def _get_or_parallel(solver_config):
+    # Worker pool for OR-parallel search, kept between requests (None if disabled)
+    global _or_parallel
+    workers = getattr(solver_config, "or_parallel_workers", 0)
+    if not workers:
+        return None
+    if _or_parallel is None:
+        _or_parallel = OrParallel(
+            workers,
+            max_depth=getattr(solver_config, "or_parallel_depth", 1),
+            first_proof=True, # asp_run merges a single proof per conclusion
+        )
+    return _or_parallel
+
+def validity_check(data, mode, output_style="html"):
+    # output_style: format of the proof trees in the result (see `asp_run`)
     assert mode in ['case', 'law']
 
     program = [{
@@ -73,8 +90,14 @@ def validity_check(data, mode):
         validity_msg.append("중복된 자연어 설명이 존재합니다. " + ",".join(nl_duplicate_list))
         validity_flag = False
     
-    # 3) Terms parsing
-    preprocessed_program, prgm_success = asp_parse_program(program)
+    # 3) Terms parsing (compiled once, and shared with 5) Run ASP)
+    solver_config = getattr(config, "solver", None)
+    rule_cache.set_max_bytes(getattr(solver_config, "rule_cache_mb", 64) * 2**20) # parsed rules, shared by requests
+    compiled_program, prgm_success = asp_compile_program(
+        program,
+        reorder_body=getattr(solver_config, "reorder_body", False),
+        materialize=getattr(solver_config, "materialize", False),
+    )
     conc_symbols = []
     conc_success = []
     for result in prgm_success:
@@ -109,7 +132,23 @@ def validity_check(data, mode):
         validity_msg.append(f"온톨로지 DB에 등록되지 않은 단어: [{', '.join(missing_ontology_total)}]")
 
     # 5) Run ASP
-    asp_result = asp_run(program, conc_symbols)
+    # The search has no depth limit of its own: always bound it by time
+    budget = SolverBudget(
+        timeout=getattr(solver_config, "timeout", 10),
+        max_goals=getattr(solver_config, "max_goals", None),
+        max_depth=getattr(solver_config, "max_depth", None),
+        max_states=getattr(solver_config, "max_states", None),
+    )
+    asp_result = asp_run(
+        compiled_program, conc_symbols, output_style=output_style, budget=budget,
+        workers=getattr(solver_config, "workers", None),
+        or_parallel=_get_or_parallel(solver_config),
+        backend=getattr(solver_config, "backend", "pysolver"),
+        explain=getattr(solver_config, "explain", False),
+    )
+    if budget.exceeded is not None:
+        validity_flag = False
+        validity_msg.append(f"증명 탐색 한도 초과 ({budget.exceeded}): 결과가 불완전합니다.")
     # check validity
     if mode == "case":
         all_conc_proved = True
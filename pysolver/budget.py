@@ -0,0 +1,100 @@
+from typing import Dict, Any, Optional
+import time
+
+class BudgetExceeded(Exception):
+    """Raised inside the search when a `SolverBudget` runs out; caught by `iter_solve`."""
+    def __init__(self, reason: str):
+        super().__init__(f"Solver budget exceeded: {reason}")
+        self.reason = reason
+
+class SolverBudget():
+    """Resource limits for a search. Every limit is optional (None: unlimited).
+
+    - `timeout`: wall-clock seconds, measured from the first search that uses this budget
+    - `max_goals`: number of goals expanded by the search
+    - `max_depth`: depth of a goal in the proof (root goal is 0)
+    - `max_states`: number of proof states created by the search (bounds its memory)
+
+    A budget can be shared by several `solve` calls (e.g. every conclusion of a request); usage accumulates.
+    Searches in worker processes use a `fork` each (limits apply per search), merged back with `merge`.
+    When a limit is hit the search stops at the next goal, `solve` returns the proofs found so far,
+    and `exceeded` holds the reason.
+    """
+    def __init__(self, timeout: float = None, max_goals: int = None, max_depth: int = None, max_states: int = None):
+        self.timeout = timeout
+        self.max_goals = max_goals
+        self.max_depth = max_depth
+        self.max_states = max_states
+
+        self.exceeded: Optional[str] = None # "timeout", "max_goals", "max_depth", "max_states"
+        # Usage
+        self.start_time: float = None
+        self.deadline: float = None
+        self.goals = 0
+        self.states = 0
+        self.depth = 0 # deepest goal seen
+
+    def start(self):
+        if self.start_time is None:
+            self.start_time = time.monotonic()
+            if self.timeout is not None:
+                self.deadline = self.start_time + self.timeout
+
+    def _exceed(self, reason: str):
+        self.exceeded = reason
+        raise BudgetExceeded(reason)
+
+    def expand(self, depth: int):
+        # Called once per goal expanded by the solver
+        if self.exceeded is not None:
+            raise BudgetExceeded(self.exceeded)
+        self.goals += 1
+        self.states += 1
+        if depth > self.depth:
+            self.depth = depth
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            self._exceed("timeout")
+        if self.max_goals is not None and self.goals > self.max_goals:
+            self._exceed("max_goals")
+        if self.max_depth is not None and depth > self.max_depth:
+            self._exceed("max_depth")
+        if self.max_states is not None and self.states > self.max_states:
+            self._exceed("max_states")
+
+    def check(self):
+        # Called between steps of work that expands no goal (e.g. bottom-up evaluation, see `materialize`)
+        if self.exceeded is not None:
+            raise BudgetExceeded(self.exceeded)
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            self._exceed("timeout")
+
+    def new_state(self):
+        # Called when the solver copies a proof state (one per rule application / proof)
+        self.states += 1
+        if self.max_states is not None and self.states > self.max_states:
+            self._exceed("max_states")
+
+    def fork(self) -> "SolverBudget":
+        """Budget for a search in another process: same limits and deadline, no usage yet."""
+        budget = SolverBudget(self.timeout, self.max_goals, self.max_depth, self.max_states)
+        budget.start_time = self.start_time
+        budget.deadline = self.deadline
+        return budget
+
+    def merge(self, other: "SolverBudget"):
+        """Add the usage of a forked budget."""
+        self.goals += other.goals
+        self.states += other.states
+        self.depth = max(self.depth, other.depth)
+        if self.exceeded is None:
+            self.exceeded = other.exceeded
+
+    def stats(self) -> Dict[str, Any]:
+        elapsed = 0.0 if self.start_time is None else time.monotonic() - self.start_time
+        return {
+            "exceeded": self.exceeded,
+            "elapsed": round(elapsed, 3),
+            "goals": self.goals,
+            "states": self.states,
+            "depth": self.depth,
+        }
@@ -0,0 +1,138 @@
+from typing import List, Dict, Set, Tuple, Iterable, Optional
+import logging
+import time
+
+from clingo.control import Control
+from clingo.ast import AST
+from clingo.symbol import Symbol, parse_term
+
+from .term import Term, Func, UnaryOp, BoolConst, Lit, Clause, symbol_to_term
+from .unify import unifiable
+from .rule_index import Signature, get_atom_key
+from .preprocess import unpack_aggregates
+from .reorder import dependency_graph
+
+class _ClingoTimeout(Exception):
+    pass
+
+def _is_atom(atom: Term) -> bool:
+    if atom.__class__ is UnaryOp and atom.op == "-":
+        atom = atom.arg
+    return atom.__class__ is Func
+
+def _consequences(ctl: Control, mode: str, deadline: float = None) -> Optional[Set[Symbol]]:
+    # Brave / cautious consequences of a grounded program (None if it has no answer set)
+    ctl.configuration.solve.enum_mode = mode
+    ctl.configuration.solve.models = 0
+    atoms = None
+    with ctl.solve(yield_=True, async_=True) as handle:
+        while True:
+            handle.resume()
+            timeout = -1 if deadline is None else max(0.0, deadline - time.monotonic())
+            if not handle.wait(timeout):
+                handle.cancel()
+                raise _ClingoTimeout()
+            model = handle.model()
+            if model is None:
+                break
+            atoms = model.symbols(atoms=True) # consequences so far; the last model has all of them
+    if atoms is None:
+        return None
+    return set(atoms)
+
+def _holds(atom: Term, consequences: Set[Symbol]) -> bool:
+    # Some instance of `atom` is among the consequences (only atoms of the same predicate are converted to terms)
+    if atom.ground:
+        return parse_term(str(atom)) in consequences
+    _, name, arity = get_atom_key(atom)
+    return any(unifiable(atom, symbol_to_term(symbol)) for symbol in consequences if symbol.match(name, arity))
+
+def _decide(ctl: Control, conclusions: List[Lit], deadline: float = None, undecided: Set[Tuple] = frozenset()) -> List[Optional[bool]]:
+    # Verdicts from the consequences of a grounded program (see `clingo_verdicts`)
+    brave = _consequences(ctl, "brave", deadline)
+    if brave is None:
+        return [False] * len(conclusions) # inconsistent
+    cautious = None
+    verdicts = []
+    for conclusion in conclusions:
+        atom = conclusion.atom
+        if not _is_atom(atom) or get_atom_key(atom) in undecided:
+            verdicts.append(None)
+        elif conclusion.sign != 1: # `x`, `not not x`
+            verdicts.append(_holds(atom, brave))
+        elif atom.ground: # `not x`
+            if cautious is None:
+                cautious = _consequences(ctl, "cautious", deadline)
+            verdicts.append(not _holds(atom, cautious))
+        else:
+            verdicts.append(None)
+    return verdicts
+
+def clingo_statements(rules: Iterable[AST]) -> Tuple[Tuple[str, ...], bool]:
+    """Statements of preprocessed rules (see `preprocess.preprocess_rule`) for clingo, with their aggregates
+    unpacked (see `preprocess.unpack_aggregates`), and whether all of them were kept: statements clingo cannot
+    ground (unsafe variables, as in `p(X) :- not q(X).`) are dropped, so that they do not fail the whole program."""
+    statements = []
+    complete = True
+    for rule in rules:
+        for unpacked in unpack_aggregates(rule):
+            statement = str(unpacked)
+            if _groundable(statement):
+                statements.append(statement)
+            else:
+                complete = False
+    return tuple(statements), complete
+
+def _groundable(statement: str) -> bool:
+    # Grounded alone: the errors of the statement itself (no facts, so this is fast)
+    ctl = Control(logger=_log)
+    try:
+        ctl.add("base", [], statement)
+        ctl.ground([("base", [])])
+    except RuntimeError:
+        return False
+    return True
+
+_FALSE_KEY = get_atom_key(BoolConst(False))
+
+def dependent_predicates(rules: Dict[Signature, List[Clause]], dropped: Iterable[Tuple]) -> Set[Tuple]:
+    """Predicates (atom keys) that depend on the `dropped` ones through `rules` (the solver terms of the
+    program), the dropped ones included: clingo cannot decide them if rules of the dropped predicates are missing."""
+    callers: Dict[Tuple, Set[Tuple]] = {}
+    for key, dependencies in dependency_graph(rules).items():
+        for dependency in dependencies:
+            callers.setdefault(dependency, set()).add(key)
+    result = set(dropped)
+    pending = list(result)
+    while len(pending) > 0:
+        for caller in callers.get(pending.pop(), ()):
+            if caller not in result:
+                result.add(caller)
+                pending.append(caller)
+    return result
+
+def clingo_verdicts(program: List[str], conclusions: List[Lit], deadline: float = None, undecided: Set[Tuple] = frozenset()) -> List[Optional[bool]]:
+    """Whether each conclusion holds, from a single grounding of `program` (rules as strings) by clingo.
+
+    `x` holds if it is true in some answer set (non-ground: some instance), and `not x` if x is false
+    in some answer set, as in the top-down solver. No conclusion holds if the program has no answer set.
+    The verdict is None where clingo cannot decide: non-ground `not x`, comparisons, a program clingo
+    cannot ground, or when `deadline` (`time.monotonic()`) passes.
+    `undecided`: predicates (atom keys) whose rules are not all in `program` (see `dependent_predicates`),
+    left undecided; every conclusion is if a constraint (`#false`) is among them.
+    """
+    if _FALSE_KEY in undecided:
+        return [None] * len(conclusions)
+    ctl = Control(logger=_log)
+    try:
+        ctl.add("base", [], "\n".join(program))
+        ctl.ground([("base", [])])
+        return _decide(ctl, conclusions, deadline, undecided)
+    except RuntimeError as e:
+        logging.warning(f"clingo could not solve the program: {e}")
+    except _ClingoTimeout:
+        logging.warning("clingo: timeout")
+    return [None] * len(conclusions)
+
+def _log(code, message):
+    logging.debug(f"clingo: {message}")
@@ -0,0 +1,147 @@
+from typing import List, Dict, Tuple, Optional
+
+from clingo.ast import Sign
+
+from .term import Term, Var, Num, Cmp, Lit, numeric_value
+from .unify import Substitution, unifiable
+
+def compare(atom: Cmp) -> bool:
+    """Truth of a ground comparison, with the semantics of comparison goals in `solve._solve_goal`."""
+    op = atom.op
+    if op == "=":
+        return unifiable(atom.left, atom.right)
+    elif op == "!=":
+        return not unifiable(atom.left, atom.right)
+    lvalue = numeric_value(atom.left)
+    rvalue = numeric_value(atom.right)
+    if lvalue is None or rvalue is None:
+        raise ValueError(f"Non-integer literals ({atom.left}, {atom.right}) cannot be compared")
+    return atom.test(lvalue, rvalue)
+
+def is_assignment(lit: Lit) -> bool:
+    """`X = t` (or `t = X`): solved by unification at once, binding X, instead of waiting for X to be bound."""
+    atom = lit.atom
+    return lit.sign == Sign.NoSign and atom.op == "=" and (atom.left.__class__ is Var or atom.right.__class__ is Var)
+
+# `not a op b` as `a op' b` (integers)
+_NEGATED_OP = {"<": ">=", "<=": ">", ">": "<=", ">=": "<", "=": "!=", "!=": "="}
+# `a op b` as `b op' a`
+_MIRRORED_OP = {"<": ">", "<=": ">=", ">": "<", ">=": "<=", "=": "=", "!=": "!="}
+
+HEAD = -1 # position of the comparisons of the rule head, before the body
+
+class ConstraintStore():
+    """Comparisons of a rule body reached before their variables are bound, suspended instead of failing.
+
+    A suspended comparison is checked again whenever a later body goal binds variables (`consistent`),
+    and holds once it is ground. Until then, comparisons between variables and integers bound the variables
+    to intervals (`X > 80, X < 60` fails at once, `X < Y, Y < 3` gives `X <= 1`): a body goal whose bindings
+    leave an interval empty is rejected before the rest of the body is tried.
+    A comparison still non-ground at the end of the body fails, as before.
+    Assignments (`X = t`, see `is_assignment`) are not suspended: they are solved at once by unification.
+    Equalities from the rule head (see `Substitution.unify_deferring`) are suspended at position `HEAD`, for the whole body.
+    """
+    __slots__ = ("constraints",)
+
+    def __init__(self):
+        self.constraints: List[Tuple[int, Lit]] = [] # (body position, comparison), in suspension order
+
+    def __len__(self):
+        return len(self.constraints)
+
+    def suspend(self, position: int, lit: Lit) -> None:
+        self.constraints.append((position, lit))
+
+    def resume(self, position: int) -> None:
+        # Backtracking over the body goal at `position`
+        if len(self.constraints) > 0 and self.constraints[-1][0] == position:
+            self.constraints.pop()
+
+    def consistent(self, substitution: Substitution) -> bool:
+        """False if some comparison fails, or the bounds of a variable are contradictory, under the bindings."""
+        bounds = []
+        for _, lit in self.constraints:
+            atom = substitution.resolve(lit.atom)
+            if atom.ground:
+                if compare(atom) == (lit.sign == Sign.Negation):
+                    return False
+                continue
+            op = atom.op if lit.sign != Sign.Negation else _NEGATED_OP[atom.op]
+            left = _bound_term(atom.left)
+            right = _bound_term(atom.right)
+            if left is not None and right is not None:
+                bounds.append((left, op, right))
+        return len(bounds) == 0 or _propagate(bounds)
+
+    def settle(self, proofs: List["ProofState"], substitution: Substitution) -> Optional[List["ProofState"]]:
+        """Proofs of a proved body with its comparisons instantiated by the final bindings
+        (suspended ones are placeholders until then), or None if a suspended comparison is still not ground."""
+        suspended = {position for position, _ in self.constraints}
+        if HEAD in suspended:
+            for position, lit in self.constraints:
+                if position == HEAD and not substitution.resolve(lit.atom).ground:
+                    return None
+        result = list(proofs)
+        for position, proof in enumerate(proofs):
+            goal = proof.goal
+            if goal.atom.__class__ is Cmp and not goal.ground:
+                goal = substitution.resolve(goal)
+                if not goal.ground and position in suspended:
+                    return None
+                result[position] = proof.copy(goal)
+        return result
+
+def _bound_term(term: Term) -> Optional[Term]:
+    # Side of a comparison usable for intervals: a variable or a number (None for anything else)
+    if term.__class__ is Var:
+        return term
+    value = numeric_value(term)
+    return None if value is None else Num(value)
+
+def _propagate(bounds: List[Tuple[Term, str, Term]]) -> bool:
+    # Narrow the interval [low, high] of each variable (None: unbounded) until nothing changes; False if one gets empty.
+    # Each pass follows one more link of a chain `X < Y < Z`, so the number of passes is bounded.
+    intervals: Dict[str, List[Optional[int]]] = {}
+    def interval(term: Term) -> List[Optional[int]]:
+        if term.__class__ is Num:
+            return [term.value, term.value]
+        result = intervals.get(term.name)
+        if result is None:
+            result = intervals[term.name] = [None, None]
+        return result
+    def narrow(term: Term, low: Optional[int], high: Optional[int]) -> bool:
+        # Intersect the interval of `term`; True if it changed
+        if term.__class__ is not Var:
+            return False
+        current = interval(term)
+        changed = False
+        if low is not None and (current[0] is None or low > current[0]):
+            current[0] = low
+            changed = True
+        if high is not None and (current[1] is None or high < current[1]):
+            current[1] = high
+            changed = True
+        return changed
+
+    for _ in range(len(bounds) + 1):
+        changed = False
+        for left, op, right in bounds:
+            for x, x_op, y in ((left, op, right), (right, _MIRRORED_OP[op], left)):
+                low, high = interval(y)
+                if x_op == "<":
+                    changed |= narrow(x, None, None if high is None else high - 1)
+                elif x_op == "<=":
+                    changed |= narrow(x, None, high)
+                elif x_op == ">":
+                    changed |= narrow(x, None if low is None else low + 1, None)
+                elif x_op == ">=":
+                    changed |= narrow(x, low, None)
+                elif x_op == "=":
+                    changed |= narrow(x, low, high)
+                # `!=` does not narrow an interval
+        for low, high in intervals.values():
+            if low is not None and high is not None and low > high:
+                return False
+        if not changed:
+            break
+    return True
@@ -1,7 +1,6 @@
-from typing import List, Dict
-from copy import deepcopy
+from typing import List, Dict, Any
 import re
-from collections import defaultdict
+from collections import defaultdict, deque
 
 from clingo.ast import *
 from clingo.control import *
@@ -15,6 +14,7 @@ class JustificationTreeNode():
         self.children = []
         self._children_group = []
         self._group = 1 # siblings with same group consist parent group
+        self._index = {} # repr -> (last) child with that repr, for `find_node`
         self.parent = None
     
     def add_child(self, child, nongroup=False):
@@ -24,6 +24,7 @@ class JustificationTreeNode():
         else:
             self._children_group.append(self._group)
         assert len(self.children) == len(self._children_group)
+        self._index[child.repr] = child
 
         child.parent = self
     
@@ -31,49 +32,68 @@ class JustificationTreeNode():
         self._group += 1
 
     def remove_child(self, repr):
-        remove_ids = [
-            i for i, c in enumerate(self.children) if c.repr == repr
-        ]
-        for remove_id in remove_ids:
-            self.children.pop(remove_id)
-            self._children_group.pop(remove_id)
-            assert len(self.children) == len(self._children_group)
-    
+        kept = [(c, g) for c, g in zip(self.children, self._children_group) if c.repr != repr]
+        self.children = [c for c, _ in kept]
+        self._children_group = [g for _, g in kept]
+        self._index.pop(repr, None)
+
+    def find_child(self, repr):
+        return self._index.get(repr)
+
+    def _reindex(self):
+        self._index = {child.repr: child for child in self.children}
+
     def _pprint(self, continuous, group):
-        # Set tree-formatted prefix
-        prefix = ""
-        for cont in continuous[:-1]:
-            prefix += "│ " if cont else "  "
-        if continuous[-1]:
-            prefix += "├ "
-        else:
-            prefix += "└ "
-        # If OR-conjunction is present, add group info
-        if group >= 0:
-            group_str = f"({group}) "
-        else:
-            group_str = ""
-        # Print prefix
-        pp = prefix + group_str + self.repr + "\n"
-        is_multiple_groups = len(set(self._children_group)) > 1
-        for i, (child, group) in enumerate(zip(self.children, self._children_group)):
-            if i < len(self.children) - 1:
-                pp += child._pprint(continuous + [True], group if is_multiple_groups else -1)
-            else:
-                pp += child._pprint(continuous + [False], group if is_multiple_groups else -1)
-        return pp
+        # Render the subtree, one line per node. Iterative: proof trees can be deeper than the recursion limit
+        lines = []
+        # (node, prefix of its line, prefix of its children's lines, group)
+        stack = [(self, _prefix(continuous), "".join("│ " if cont else "  " for cont in continuous), group)]
+        while len(stack) > 0:
+            node, prefix, child_prefix, group = stack.pop()
+            # If OR-conjunction is present, add group info
+            group_str = f"({group}) " if group >= 0 else ""
+            lines.append(prefix + group_str + node._anonymized_repr())
+            is_multiple_groups = len(set(node._children_group)) > 1
+            last = len(node.children) - 1
+            for i in range(last, -1, -1): # pushed in reverse: popped in order
+                child_group = node._children_group[i] if is_multiple_groups else -1
+                if i < last:
+                    stack.append((node.children[i], child_prefix + "├ ", child_prefix + "│ ", child_group))
+                else:
+                    stack.append((node.children[i], child_prefix + "└ ", child_prefix + "  ", child_group))
+        return "\n".join(lines) + "\n"
+
+    def _anonymized_repr(self):
+        # Same result as anonymizing the whole rendered text: a node is always preceded by a space there
+        if _UPPERCASE.search(self.repr) is None:
+            return self.repr # no variables
+        return anonymize_vars(" " + self.repr)[1:]
 
     def _transform(self, function):
-        # Postorder transformation
-        for child in self.children:
-            child._transform(function) # Propagate to children first to prevent infinite recursion
-        function(self) # Transform myself
+        # Postorder transformation (children first, to prevent infinite recursion)
+        order = []
+        stack = [self]
+        while len(stack) > 0:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(node.children)
+        for node in reversed(order):
+            function(node) # Transform myself
+        for node in order:
+            node._reindex() # reprs may have changed
 
     def __str__(self):
         return self.repr
     def __repr__(self):
         return "`" + self.repr + "`"
 
+_UPPERCASE = re.compile(r"[A-Z]") # every variable name has one
+
+def _prefix(continuous):
+    # Tree-formatted prefix of a line
+    prefix = "".join("│ " if cont else "  " for cont in continuous[:-1])
+    return prefix + ("├ " if continuous[-1] else "└ ")
+
 class JustificationTree():
     def __init__(self, proofs: List[ProofState]):
         if proofs is None:
@@ -81,12 +101,12 @@ class JustificationTree():
             return
 
         self.root = JustificationTreeNode("")
-        bfs = [(proofs, self.root)]
+        bfs = deque([(proofs, self.root)])
         # bfs on state to traverse all nodes
         while len(bfs) > 0:
-            proofs, parent_node = bfs.pop(0)
+            proofs, parent_node = bfs.popleft()
 
-            # Group proofs by goal
+            # Group proofs by goal (terms are hashed once, at construction)
             unique_goals = defaultdict(list)
             for state in proofs:
                 unique_goals[state.goal].append(state)
@@ -106,10 +126,11 @@ class JustificationTree():
                         # BFS Propagation
                         # Collect subgoals per rule index
                         # a :- b(X), c(X) -> group all b(X), group all c(X)
-                        if state.rule not in substates_per_rule:
-                            substates_per_rule[state.rule] = [list() for _ in state.rule.body]
+                        substates_per_idx = substates_per_rule.get(state.rule)
+                        if substates_per_idx is None:
+                            substates_per_idx = substates_per_rule[state.rule] = [list() for _ in state.rule.body]
                         for idx, substate in enumerate(state.proof):
-                            substates_per_rule[state.rule][idx].append(substate)
+                            substates_per_idx[idx].append(substate)
                 # BFS Proceed (group same rules together)
                 for rule, substates_per_idx in substates_per_rule.items():
                     for ith_goals in substates_per_idx:
@@ -119,8 +140,35 @@ class JustificationTree():
             self.root = self.root.children[0]
     
     def __str__(self):
-        result_str = self.root._pprint([False], -1)
-        return anonymize_vars(result_str)
+        # Variables are anonymized per node (see `JustificationTreeNode._anonymized_repr`)
+        return self.root._pprint([False], -1)
+
+    def to_json(self) -> Dict[str, Any]:
+        """Compact form of the tree for clients (JSON-compatible), drawn like `str(tree)`.
+        `nodes` holds `[label, children]`, or `[label, children, groups]` if the children form several OR-groups
+        (`groups[i]`: group of child i). Children are ids (indices into `nodes`); the root is `nodes[root]`.
+        Identical subtrees are stored once and shared by id. Labels are anonymized as in `str(tree)`."""
+        nodes = []
+        ids: Dict[tuple, int] = {}
+        node_ids = {} # id(node) -> id in `nodes`
+        # Postorder (children first), iterative: proof trees can be deeper than the recursion limit
+        stack = [(self.root, False)]
+        while len(stack) > 0:
+            node, expanded = stack.pop()
+            if not expanded:
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(node.children))
+                continue
+            children = tuple(node_ids[id(child)] for child in node.children)
+            groups = tuple(node._children_group) if len(set(node._children_group)) > 1 else None
+            label = node._anonymized_repr()
+            key = (label, children, groups)
+            node_id = ids.get(key)
+            if node_id is None:
+                node_id = ids[key] = len(nodes)
+                nodes.append([label, list(children)] if groups is None else [label, list(children), list(groups)])
+            node_ids[id(node)] = node_id
+        return {"nodes": nodes, "root": node_ids[id(self.root)]}
 
     def transform(self, function):
         self.root._transform(function)
@@ -129,13 +177,8 @@ class JustificationTree():
         # Starts with first level(not root)
         node = self.root
         for node_rep in node_seq:
-            new_node = None
-            for child in node.children:
-                if child.repr == node_rep:
-                    new_node = child
-            if new_node is not None:
-                node = new_node
-            else:
+            node = node.find_child(node_rep)
+            if node is None:
                 # raise KeyError("Cannot find key " + node_rep + " in " + str(node_seq))
                 return None
         return node
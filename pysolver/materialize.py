@@ -0,0 +1,199 @@
+from typing import List, Dict, Set, Tuple, Optional, Iterator
+import logging
+
+from clingo.ast import Sign
+
+from .term import Term, Var, Num, Str, Func, UnaryOp, Cmp, Lit, Clause, RuleTemplate
+from .unify import Substitution
+from .rule_index import RuleIndex, Signature, get_signature, get_arguments
+from .reorder import _variables, _strata
+from .constraints import compare
+from .proof_state import ProofState
+from .budget import SolverBudget
+
+##### Dependency analysis #####
+
+def _is_simple(term: Term) -> bool:
+    # Constants, variables and functions of them (arithmetic, pools and intervals are left to the top-down solver)
+    cls = term.__class__
+    if cls is Var or cls is Num or cls is Str:
+        return True
+    if cls is Func:
+        return all(_is_simple(arg) for arg in term.args)
+    return False
+
+def _is_predicate(lit: Lit) -> bool:
+    atom = lit.atom
+    if atom.__class__ is UnaryOp and atom.op == "-":
+        atom = atom.arg
+    return atom.__class__ is Func and all(_is_simple(arg) for arg in atom.args)
+
+def _is_definite(rule: Clause) -> bool:
+    # Rules evaluated bottom-up exactly as top-down: positive head and body literals,
+    # and comparisons that are ground when reached (variables bound by the literals before them)
+    if rule.head.sign != Sign.NoSign or not _is_predicate(rule.head):
+        return False
+    bound = set()
+    for lit in rule.body:
+        if lit.sign != Sign.NoSign:
+            return False
+        if lit.atom.__class__ is Cmp:
+            if not (_is_simple(lit.atom.left) and _is_simple(lit.atom.right)) or not _variables(lit, anonymous=True) <= bound:
+                return False
+        elif _is_predicate(lit):
+            bound |= _variables(lit)
+        else:
+            return False # aggregates, #true, ...
+    return _variables(rule.head, anonymous=True) <= bound # safe: facts are ground
+
+def _grows(rule: Clause) -> bool:
+    # Head builds new terms (e.g. `nat(s(X)) :- nat(X).`): recursion through it may not terminate
+    return any(arg.__class__ is Func and not arg.ground for arg in get_arguments(rule.head))
+
+##### Bottom-up evaluation #####
+
+_DELTA = -1 # window of a literal that matches the facts of the last round
+
+class Materialization():
+    """Least model of the negation-free part of a program, computed bottom-up.
+
+    A predicate is materialized if all its rules are definite (positive literals and comparisons only, safe)
+    and only use materialized predicates. Its strata (strongly connected components of the dependency graph)
+    are evaluated in dependency order with semi-naive evaluation: a recursive rule is only re-applied
+    to combinations that contain a fact derived in the previous round.
+
+    Each fact keeps the proof of its first derivation (rule instance and proofs of the body, in source order),
+    so `find` answers with proofs like the top-down solver, one per fact.
+    Recursion through rules that build new terms is left to the top-down solver, since it may not terminate.
+    With `budget`, each derived fact counts as a proof state and the timeout is checked for every rule applied;
+    `BudgetExceeded` is raised through the constructor.
+    """
+    def __init__(self, rule_index: RuleIndex, budget: SolverBudget = None):
+        self.budget = budget
+        self.predicates: Set[Signature] = set()
+        self.facts = RuleIndex() # derived facts, as ground clauses
+        self.proofs: Dict[Lit, ProofState] = {}
+        self.rounds: Dict[Lit, int] = {} # round of a fact within its stratum
+        self.delta = RuleIndex() # facts of the last round
+
+        rules = rule_index.rules
+        candidates = {
+            signature for signature, signature_rules in rules.items()
+            if signature[0] == Sign.NoSign and all(_is_definite(rule) for rule in signature_rules)
+        }
+        dependencies = {
+            signature: {get_signature(lit) for rule in rules[signature] for lit in rule.body if lit.atom.__class__ is not Cmp}
+            for signature in candidates
+        }
+        # Predicates without rules are empty relations; any other dependency must be materialized too
+        changed = True
+        while changed:
+            changed = False
+            for signature in list(candidates):
+                if any(dep in rules and dep not in candidates for dep in dependencies[signature]):
+                    candidates.discard(signature)
+                    changed = True
+        graph = {signature: dependencies[signature] & candidates for signature in candidates}
+
+        for component in _strata(graph):
+            members = set(component)
+            component_rules = [rule for signature in component for rule in rules[signature]]
+            if any(not dep in self.predicates and not dep in members for signature in component for dep in graph[signature]):
+                continue # depends on a stratum that was not materialized
+            if any(_grows(rule) for rule in component_rules) and \
+                any(dep in members for signature in component for dep in graph[signature]):
+                continue
+            try:
+                self._evaluate(component_rules, members)
+            except ValueError as e:
+                logging.warning(f"Materialization: {component} left to the top-down solver ({e})")
+                continue
+            self.predicates |= members
+        logging.debug(f"Materialization: {len(self.proofs)} facts of {len(self.predicates)} predicates")
+
+    def find(self, goal: Lit) -> Optional[List[ProofState]]:
+        """Proofs of the facts that unify with `goal`, or None if its predicate is not materialized."""
+        if get_signature(goal) not in self.predicates:
+            return None
+        return [self.proofs[fact.head] for fact in self.facts.find(goal)]
+
+    def _evaluate(self, rules: List[Clause], members: Set[Signature]) -> None:
+        # Semi-naive evaluation of a stratum
+        rules = [RuleTemplate(rule).instantiate(0) for rule in rules] # anonymous variables are distinct
+        recursive = [
+            [i for i, lit in enumerate(rule.body) if lit.atom.__class__ is not Cmp and get_signature(lit) in members]
+            for rule in rules
+        ]
+        # Round 0: rules without recursive literals (the stratum is still empty)
+        new_facts = {}
+        for rule, positions in zip(rules, recursive):
+            if len(positions) == 0:
+                self._apply(rule, [None] * len(rule.body), new_facts)
+        round_idx = 0
+        while len(new_facts) > 0:
+            self._add(new_facts, round_idx)
+            # Next round: literal i matches the facts of the last round (delta);
+            # recursive literals before it only match older facts, so each combination is found once
+            new_facts = {}
+            for rule, positions in zip(rules, recursive):
+                for k, i in enumerate(positions):
+                    windows = [None] * len(rule.body)
+                    for j in positions[:k]:
+                        windows[j] = round_idx # older than this round
+                    windows[i] = _DELTA
+                    self._apply(rule, windows, new_facts)
+            round_idx += 1
+        self.delta = RuleIndex()
+
+    def _add(self, new_facts: Dict[Lit, ProofState], round_idx: int) -> None:
+        self.delta = RuleIndex()
+        for fact, proof in new_facts.items():
+            fact_clause = Clause(fact, ())
+            self.facts.add(fact_clause)
+            self.delta.add(fact_clause)
+            self.proofs[fact] = proof
+            self.rounds[fact] = round_idx
+
+    def _apply(self, rule: Clause, windows: List[Optional[int]], new_facts: Dict[Lit, ProofState]) -> None:
+        budget = self.budget
+        if budget is not None:
+            budget.check()
+        substitution = Substitution()
+        for _ in self._matches(rule.body, 0, substitution, windows):
+            head = substitution.resolve(rule.head)
+            if head in self.proofs or head in new_facts:
+                continue
+            if budget is not None:
+                budget.new_state()
+            body = tuple(substitution.resolve(lit) for lit in rule.body)
+            proof = ProofState(head)
+            proof.proved = True
+            proof.rule = Clause(head, body)
+            proof.proof = tuple(self.proofs[lit] if lit.atom.__class__ is not Cmp else self._comparison(lit) for lit in body)
+            new_facts[head] = proof
+
+    def _comparison(self, lit: Lit) -> ProofState:
+        proof = ProofState(lit)
+        proof.proved = True
+        return proof
+
+    def _matches(self, body: Tuple[Lit, ...], i: int, substitution: Substitution, windows: List[Optional[int]]) -> Iterator[None]:
+        # Bindings (on `substitution`) of every match of body[i:] against the facts, from left to right.
+        # windows[i]: facts that literal i may match: all (None), the last round (_DELTA), or rounds before windows[i]
+        if i == len(body):
+            yield
+            return
+        goal = substitution.resolve(body[i])
+        if goal.atom.__class__ is Cmp:
+            if compare(goal.atom):
+                yield from self._matches(body, i + 1, substitution, windows)
+            return
+        window = windows[i]
+        for fact in (self.delta if window == _DELTA else self.facts).candidates(goal):
+            fact = fact.head
+            if window is not None and window != _DELTA and self.rounds[fact] >= window:
+                continue
+            mark = substitution.mark()
+            if substitution.unify(goal, fact):
+                yield from self._matches(body, i + 1, substitution, windows)
+                substitution.undo(mark)
@@ -0,0 +1,86 @@
+from typing import List, Tuple
+from concurrent.futures import ProcessPoolExecutor
+import pickle
+
+from .proof_state import ProofContext, ProofState
+from .term import Clause
+from .budget import SolverBudget, BudgetExceeded
+
+class OrParallel():
+    """OR-parallel search: alternative rules for a goal are tried in worker processes.
+
+    Goals shallower than `max_depth` with several matching rules send each rule (branch) to a worker;
+    the proofs of every branch are merged in rule order. Deeper goals are solved in the worker, sequentially.
+    With `first_proof`, branches of the root goal only look for their first proof (for `solve(..., limit=1)`).
+    Refutations of `not x` always need a single proof of x.
+
+    Branches are computed eagerly (not lazily), and each gets its own fork of the budget.
+    Not used with tabling or `unproved_callback`, which share state between branches.
+    A pool can serve any number of searches and programs.
+    """
+    # Variable indices of a branch start at a multiple of this, so that variables of branches never clash
+    VARIABLE_INDEX_STRIDE = 10 ** 9
+
+    def __init__(self, workers: int, max_depth: int = 1, first_proof: bool = False):
+        self.workers = workers
+        self.max_depth = max_depth
+        self.first_proof = first_proof
+        self.executor: ProcessPoolExecutor = None
+        self._program: Tuple[str, bytes] = None # (fingerprint, pickled context) last sent to workers
+
+    def applies(self, state: ProofState, rules: List[Clause]) -> bool:
+        return len(rules) > 1 and state.depth < self.max_depth
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def apply_rules(self, state: ProofState, rules: List[Clause], context: ProofContext, budget: SolverBudget = None) -> List[List[ProofState]]:
+        """Proofs of `state` for each rule (see `solve._apply_rules`), computed in parallel."""
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        if self._program is None or self._program[0] != context.fingerprint:
+            self._program = (context.fingerprint, pickle.dumps(context))
+        fingerprint, program_bytes = self._program
+
+        first = state.parent is None and (state.caller is not None or self.first_proof)
+        futures = []
+        for rule in rules:
+            context.variable_index += self.VARIABLE_INDEX_STRIDE
+            futures.append(self.executor.submit(
+                _apply_rule_worker,
+                fingerprint, program_bytes, context.variable_index,
+                state, rule, first, budget.fork() if budget is not None else None
+            ))
+        context.variable_index += self.VARIABLE_INDEX_STRIDE
+
+        results = []
+        for future in futures: # rule order
+            proofs, branch_budget = future.result()
+            if budget is not None:
+                budget.merge(branch_budget)
+            results.append(proofs)
+        if budget is not None and budget.exceeded is not None:
+            raise BudgetExceeded(budget.exceeded)
+        return results
+
+_worker_context: Tuple[str, ProofContext] = None # (fingerprint, context) last received by this worker
+
+def _apply_rule_worker(fingerprint: str, program_bytes: bytes, variable_index: int, state: ProofState, rule: Clause, first: bool, budget: SolverBudget):
+    from .solve import _run, _apply_rules
+    global _worker_context
+    if _worker_context is None or _worker_context[0] != fingerprint:
+        _worker_context = (fingerprint, pickle.loads(program_bytes))
+    context = _worker_context[1]
+    context.variable_index = variable_index
+
+    proofs = []
+    try:
+        for proof in _run(_apply_rules(state, [rule], context, budget=budget)):
+            proofs.append(proof)
+            if first:
+                break
+    except BudgetExceeded:
+        pass # reported by `budget.exceeded`
+    return proofs, budget
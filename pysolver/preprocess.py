@@ -7,49 +7,19 @@ from clingo.ast import *
 from clingo.control import *
 from clingo.symbol import *
 
-from .utils import convert_numeric_string_to_int
+from .utils import convert_numeric_string_to_int, flip_sign
 
-def powerset(iterable):
-    s = list(iterable)
-    return itertools.chain.from_iterable(itertools.combinations(s, r) for r in range(len(s)+1))
-
-def unpack_count_aggregates(term: AST) -> List[AST]:
-    # {a; b; c} -> a or b or c
-    assert term.ast_type == ASTType.Rule
-    body = term.body
-
-    new_body = []
-    new_rules = []
-
-    for body_lit in body:
-        if body_lit.ast_type == ASTType.Literal:
-            body_atom = body_lit.atom
-            if body_atom.ast_type in [ASTType.Aggregate, ASTType.BodyAggregate]:
-                # Found aggregate
-                if body_atom.ast_type == ASTType.BodyAggregate and body_atom.function != AggregateFunction.Count:
-                    raise ValueError(f"Do not support Aggregate function {body_atom.function}")
-
-                new_body.append(
-                    [[(deepcopy(lit).literal)]
-                        for lit in body_atom.elements]
-                )
-            else:
-                # Non-aggregate
-                new_body.append([[body_lit]])
-
-    # Create all possible rules
-    for unpacked_body in itertools.product(*new_body):
-        # Flatten list
-        unpacked_body = [item for sublist in unpacked_body for item in sublist]
-        # Add new rules
-        new_rule = Rule(
-            term.location,
-            term.head,
-            unpacked_body
-        )
-        new_rules.append(new_rule)
-
-    return new_rules
+def check_rule(rule: AST) -> None:
+    # Errors of the statement itself, so they surface before the duals are generated (see `get_duals`)
+    assert rule.ast_type == ASTType.Rule
+    head = rule.head
+    if head.ast_type == ASTType.Literal and head.atom.ast_type not in [ASTType.SymbolicAtom, ASTType.BooleanConstant]:
+        raise ValueError("All rule heads must be non-conditional simple literals")
+    # {a; b; c} is a disjunction (a or b or c), solved as a single body element (see `solve._solve_goal`)
+    for body_lit in rule.body:
+        if body_lit.ast_type == ASTType.Literal and body_lit.atom.ast_type == ASTType.BodyAggregate \
+            and body_lit.atom.function != AggregateFunction.Count:
+            raise ValueError(f"Do not support Aggregate function {body_lit.atom.function}")
 
 def get_dual(rule: AST) -> List[AST]:
     assert rule.ast_type == ASTType.Rule
@@ -209,18 +179,60 @@ def translate_numeric_string(rule:AST) -> AST:
     elif rule.head.ast_type == ASTType.BooleanConstant:
         pass # do nothing
 
-    for body_lit in rule.body:
+    def convert_lit(body_lit: AST) -> None:
         if body_lit.atom.ast_type == ASTType.SymbolicAtom:
             body_lit.atom.symbol = convert_num_str(body_lit.atom.symbol)
         elif body_lit.atom.ast_type == ASTType.Comparison:
             body_lit.atom.term = convert_num_str(body_lit.atom.term)
             for guard in body_lit.atom.guards:
                 guard.term = convert_num_str(guard.term)
+        elif body_lit.atom.ast_type == ASTType.Aggregate:
+            for element in body_lit.atom.elements:
+                convert_lit(element.literal)
+
+    for body_lit in rule.body:
+        convert_lit(body_lit)
     return rule
 
+def preprocess_rule(rule: AST) -> List[AST]:
+    """Rules of a raw statement, without their duals: unpooled, with numeric strings converted to integers.
+    Raises the errors of the statement (unsupported aggregates and heads)."""
+    if rule.ast_type != ASTType.Rule:
+        return []
+    check_rule(rule)
+    return [translate_numeric_string(unpooled) for unpooled in rule.unpool()]
+
+def get_duals(rule: AST) -> List[AST]:
+    """Dual statements of a rule returned by `preprocess_rule`."""
+    # not pred :- -pred DISABLED TO PREVENT INFINITE LOOPS (explicit duals)
+    # :- a, -a (constraints)
+    return get_dual(rule) + get_explicit_dual(rule) + get_constraints(rule)
+
+def unpack_aggregates(rule: AST) -> List[AST]:
+    """Rules of `rule` (see `preprocess_rule`) without disjunctive aggregates, for clingo (which finds them unsafe):
+    `{a; b}` gives one rule per element, `not {a; b}` the body `not a, not b`. Exponential in the number of
+    aggregates of a body; the top-down solver keeps them as OR-nodes instead."""
+    assert rule.ast_type == ASTType.Rule
+    alternatives = []
+    for body_lit in rule.body:
+        if body_lit.ast_type == ASTType.Literal and body_lit.atom.ast_type == ASTType.Aggregate:
+            literals = [element.literal for element in body_lit.atom.elements]
+            if body_lit.sign != Sign.Negation:
+                alternatives.append([[literal] for literal in literals])
+            else:
+                alternatives.append([[flip_sign(literal) for literal in literals]])
+        else:
+            alternatives.append([[body_lit]])
+    if all(len(alternative) == 1 and alternative[0][0] is body_lit for alternative, body_lit in zip(alternatives, rule.body)):
+        return [rule] # no aggregate
+    return [
+        Rule(rule.location, rule.head, [lit for lits in body for lit in lits])
+        for body in itertools.product(*alternatives)
+    ]
+
 def preprocess(rule: AST) -> List[AST]:
     """Translate raw rule statement to preprocessed rule by...
-    - Unpack OR statement aggregates
+    - Check OR statement aggregates (kept as they are: one rule per statement)
     - Unpack pooling
     - Convert numeric strings that share dimensions to integer
     - Add dual statements
@@ -229,30 +241,10 @@ def preprocess(rule: AST) -> List[AST]:
         rule (AST): String to parse. Might raise syntax error if parsing is failed
 
     Returns:
-        List[AST]: _description_
+        List[AST]: each rule, followed by its dual statements
     """
-
     new_rules = []
-
-    if rule.ast_type == ASTType.Rule:
-        unpacked_count_rules = unpack_count_aggregates(rule)
-        
-        unpooled_rules = []
-        for rule in unpacked_count_rules:
-            unpooled_rules.extend(rule.unpool())
-
-        for t3 in unpooled_rules:
-            t3 = translate_numeric_string(t3)
-            new_rules.append(t3)
-
-            # Dual statements
-            for dual in get_dual(t3):
-                new_rules.append(dual)
-            # not pred :- -pred DISABLED TO PREVENT INFINITE LOOPS
-            for explicit_dual in get_explicit_dual(t3):
-                new_rules.append(explicit_dual)
-            # :- a, -a
-            for constraint in get_constraints(t3):
-                new_rules.append(constraint)
-
-    return new_rules
\ No newline at end of file
+    for new_rule in preprocess_rule(rule):
+        new_rules.append(new_rule)
+        new_rules.extend(get_duals(new_rule))
+    return new_rules
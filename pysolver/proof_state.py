@@ -1,14 +1,18 @@
-from typing import List, Tuple, Dict, Any
-from copy import deepcopy, copy
-import re
+from typing import List, Tuple, Dict, Any, Optional
+import hashlib
 from clingo.ast import *
 
-from .utils import flip_sign, is_negated, get_hash_head, parse_line
-from .unify import find_bindings, bind
-from .preprocess import preprocess
+from .utils import is_negated
+from .unify import find_bindings, unifiable, bind
+from .rule_cache import rule_cache, ParsedRule
+from .term import Term, Lit, Clause, RuleTemplate
+from .rule_index import RuleIndex, get_atom_key
+from .tabling import variant_key
+from .reorder import reorder_body, recursive_components
+from .budget import SolverBudget
 
 class ProofContext():
-    def __init__(self):
+    def __init__(self, reorder_body: bool = False, materialize: bool = False):
         """A global context manager that runs through a proof.
         Stores current rules, variable re-indexing information, and more.
 
@@ -17,78 +21,194 @@ class ProofContext():
         - `asp` : contains a string version of the logic program.
 
         ex. [{'asp': 'a :- b, c(X).', 'comment': 'if b holds and c holds for any X, a holds.'}]
+
+        With `reorder_body`, rule bodies are evaluated in a cheaper order (see `reorder.reorder_body`);
+        proofs still list the body in the source order.
+        With `materialize`, the negation-free part of the program is computed bottom-up once per program,
+        and goals of those predicates are looked up (see `materialize.Materialization`).
         """
         self.program: List[Dict[str, Any]] = []
-        # Preprocess programs (add dual, split OR statements,...)
-        self.preprocessed_program: List[AST] = []
+        # Parsed lines (see `rule_cache.ParsedRule`), in order; their duals are generated on first use
+        self.parsed_rules: List[ParsedRule] = []
         
-        # Hashed dictionary for fast retrieval of rules
-        self.rule_dict: Dict[str, List[AST]] = {}
+        # Clause index for fast retrieval of rules (rules are converted to immutable terms)
+        self.rule_index: RuleIndex = RuleIndex()
+        # Rules compiled for renaming (see `reindex_variables`)
+        self.templates: Dict[Clause, RuleTemplate] = {}
+        # Evaluation order of rule bodies: rule -> (fingerprint, order or None for the source order)
+        self.reorder_body = reorder_body
+        self.body_orders: Dict[Clause, Tuple[str, Tuple[int, ...]]] = {}
+        # Recursive components of the predicates, for reordering: (fingerprint, see `reorder.recursive_components`)
+        self.components: Tuple[str, Dict[Tuple, int]] = None
+        # Derived facts of the negation-free part: (fingerprint, Materialization)
+        self.materialize = materialize
+        self.materialization: Tuple[str, Any] = None
 
         # Global index for rule instantiation.
         self.variable_index: int = 0
 
+        # Fingerprint of the program (chained hash, updated on `add_rule`)
+        self.fingerprint: str = ""
+        # Cached consistency check: (fingerprint, proof of `#false` or None); see `solve.prove_false`
+        self.consistency: Tuple[str, ProofState] = None
+
     def add_rule(self, line: Dict[str, Any]) -> None:
         self.program.append(line)
+        self.fingerprint = hashlib.sha1((self.fingerprint + line["asp"]).encode()).hexdigest()
+        self.consistency = None # program changed
         
-        # Parse string to AST
-        rule = parse_line(line["asp"])
+        # Parse string to AST, preprocess, and convert to immutable term (cached across programs)
         assert "asp" in line
+        parsed = rule_cache.get(line["asp"])
+        rules = parsed.terms
+        if len(rules) == 0:
+            return # directives, ...
+        self.parsed_rules.append(parsed)
         
-        # Add to preprocessed program list
-        self.preprocessed_program.extend(preprocess(rule))
-        
-        # Add to rule dict (for fast finding)
-        hash_head = get_hash_head(rule)
-        if hash_head not in self.rule_dict:
-            self.rule_dict[hash_head] = []
-        
-        # Check for duplicates
-        is_dup = False
-        # FIXME
-        # for existing_rule in self.rule_dict[hash_head]:
-        #     if find_bindings(rule, existing_rule):
-        #         is_dup = True
-        if not is_dup:
-            self.rule_dict[hash_head].append(rule)
-
-    def find_rule(self, goal: AST):
-        hash_head = get_hash_head(goal)
-        if hash_head not in self.rule_dict:
-            return []
-        relevant_rules = self.rule_dict[hash_head]
-        result = []
-        for rule in relevant_rules:
-            head = rule.head
-            if find_bindings(head, goal) is not None:
-                result.append(deepcopy(rule))
-        return result
+        # Add to rule index (for fast finding)
+        for rule in rules:
+            # Check for duplicates
+            is_dup = False
+            # FIXME
+            # for existing_rule in self.rule_index.find(rule.head):
+            #     if find_bindings(rule, existing_rule):
+            #         is_dup = True
+            if not is_dup:
+                self.rule_index.add(rule)
+                self.templates[rule] = RuleTemplate(rule)
 
-    def reindex_variables(self, rule):
-        rule_str = str(rule)
-        # Re-index
-        rule_str = re.sub(r"([,( ])(_*[A-Z][A-Za-z_0-9]*)(?=[,)]| [+\-*/%><=!])", f"\g<1>\g<2>_{self.variable_index}", rule_str) # attatch rule_idx to ordinary(non-anonymous) variables
-        anonym_idx = 0
-        while True:
-            rule_str, replaced = re.subn(r"([,( ])_(?=[,)]| [+\-*/%><=!])", f"\g<1>_Anon_{self.variable_index}_{anonym_idx}", rule_str, count=1)
-            if replaced == 0:
-                break
-            anonym_idx += 1
+    @property
+    def preprocessed_program(self) -> List[AST]:
+        # Preprocessed rules, each followed by its duals (see `preprocess.preprocess`)
+        return [statement for parsed in self.parsed_rules for statement in parsed.preprocessed]
+
+    def __getstate__(self):
+        # Pickled for worker processes: clingo ASTs cannot be pickled, and the solver does not use them
+        state = self.__dict__.copy()
+        state["parsed_rules"] = []
+        state["materialization"] = None # recomputed on demand (deep proof chains)
+        return state
+
+    def find_rule(self, goal: Lit) -> List[Clause]:
+        # Rules are immutable; no copy required
+        return self.rule_index.find(goal)
+
+    def find_derived(self, goal: Lit, budget: SolverBudget = None) -> Optional[List["ProofState"]]:
+        # Proofs of `goal` from materialized facts; None if its predicate is proved top-down.
+        # The materialization is charged to `budget`; if it runs out, nothing is kept (computed again by the next search)
+        if not self.materialize:
+            return None
+        if self.materialization is None or self.materialization[0] != self.fingerprint:
+            from .materialize import Materialization
+            self.materialization = (self.fingerprint, Materialization(self.rule_index, budget))
+        return self.materialization[1].find(goal)
+
+    def get_body_order(self, rule: Clause) -> Optional[Tuple[int, ...]]:
+        # Computed on first use: costs depend on the whole program (rule counts)
+        if not self.reorder_body or len(rule.body) < 2:
+            return None
+        cached = self.body_orders.get(rule)
+        if cached is not None and cached[0] == self.fingerprint:
+            return cached[1]
+        if self.components is None or self.components[0] != self.fingerprint:
+            self.components = (self.fingerprint, recursive_components(self.rule_index.rules))
+        order = reorder_body(rule, self.rule_index.count, self.components[1])
+        if order == tuple(range(len(rule.body))):
+            order = None
+        self.body_orders[rule] = (self.fingerprint, order)
+        return order
+
+    def reindex_variables(self, rule: Clause) -> Clause:
+        # Attach rule_idx to ordinary(non-anonymous) variables, and number anonymous variables
+        if rule.ground:
+            return rule
+        template = self.templates.get(rule)
+        if template is None:
+            template = self.templates[rule] = RuleTemplate(rule)
         self.variable_index += 1
-        return parse_line(rule_str)
+        return template.instantiate(self.variable_index - 1)
+
+class AncestorIndex():
+    """Persistent map from an atom key to the nearest state with that key on a proof path.
+    `set` returns a new map and shares all but one bucket with the old one,
+    so each state of a path keeps its own index in O(1) time and memory (amortized)."""
+    __slots__ = ("buckets",)
+    WIDTH = 32 # power of 2
+
+    def __init__(self, buckets: Tuple[Dict, ...]):
+        self.buckets = buckets
+
+    def get(self, key: Tuple) -> "ProofState":
+        return self.buckets[hash(key) & (self.WIDTH - 1)].get(key)
+
+    def set(self, key: Tuple, state: "ProofState") -> "AncestorIndex":
+        i = hash(key) & (self.WIDTH - 1)
+        bucket = self.buckets[i].copy()
+        bucket[key] = state
+        return AncestorIndex(self.buckets[:i] + (bucket,) + self.buckets[i+1:])
+AncestorIndex.EMPTY = AncestorIndex(({},) * AncestorIndex.WIDTH)
 
 class ProofState():
-    def __init__(self, goal: AST):
-        assert goal.ast_type == ASTType.Literal
+    """A node of the search / proof tree.
+
+    A node is created for each goal to prove (a call), and a new node for each proof of it.
+    Nodes share their parent, and proof nodes share their subproofs (`proof` is a tuple):
+    extending a proof creates one node, and never copies a subtree.
+    Only `proved`, `table_frame` and the `_path` cache of a call are updated during its search.
+    """
+    __slots__ = ("original_goal", "proved", "parent", "depth", "caller", "goal", "_bindings", "rule", "table_frame", "_path", "proof")
+
+    def __init__(self, goal: Lit):
+        assert isinstance(goal, Lit)
         self.original_goal = goal
         self.proved = False
         self.parent: ProofState = None
-        # Bindings
-        self.goal = deepcopy(goal)
-        self.bindings: Dict[AST, AST] = {}
-        self.rule: AST = None
+        self.depth = 0 # distance from the root goal
+        self.caller: ProofState = None # for a parentless goal proved to refute `not goal`: the state of `not goal`
+        # Bindings (terms are immutable; binding replaces `goal` instead of mutating it)
+        self.goal = goal
+        self._bindings: Dict[str, Term] = None # computed on demand
+        self.rule: Clause = None
+        # Tabled call being evaluated for this goal (see `tabling.AnswerTable`)
+        self.table_frame = None
+        # Loop detection index of the path to this state (see `_path_info`)
+        self._path: Tuple = None
         # Children
-        self.proof: List[ProofState]= [] # proved
+        self.proof: Tuple[ProofState, ...] = () # proved
+
+    def copy(self, goal: Lit = None) -> "ProofState":
+        """New node for the same call, sharing everything but the (optionally replaced) goal."""
+        result = ProofState.__new__(ProofState)
+        result.original_goal = self.original_goal
+        result.proved = self.proved
+        result.parent = self.parent
+        result.depth = self.depth
+        result.caller = self.caller
+        result.goal = self.goal if goal is None else goal
+        result._bindings = self._bindings if goal is None else None
+        result.rule = self.rule
+        result.table_frame = self.table_frame # shared with copies of the same call
+        result._path = None # refers to this state; rebuilt for the copy
+        result.proof = self.proof
+        return result
+    __copy__ = copy
+    def __deepcopy__(self, memo):
+        return self.copy() # subtrees are shared, never copied
+
+    def with_proof(self, goal: Lit, proof: Tuple["ProofState", ...], rule: Clause) -> "ProofState":
+        """Proof of this call: `goal` (bound) proved by `rule` and the proofs of its body."""
+        result = self.copy(goal)
+        result.proved = True
+        result.rule = rule
+        result.proof = proof
+        return result
+
+    @property
+    def bindings(self) -> Dict[str, Term]:
+        # Bindings of the variables of the original goal
+        if self._bindings is None:
+            self._bindings = find_bindings(self.original_goal, self.goal) or {}
+        return self._bindings
 
     def get_root(self):
         curr_state = self
@@ -96,35 +216,96 @@ class ProofState():
             curr_state = curr_state.parent
         return curr_state
 
+    def _path_info(self) -> Tuple:
+        # (goal, ancestor index, negation count, nearest tabled state) of the path from the root to this state.
+        # Cached per goal: a state whose goal is replaced gets new path information.
+        path = self._path
+        if path is not None and path[0] is self.goal:
+            return path
+        # Collect states without up-to-date information (usually only this one)
+        stale = []
+        curr_state = self
+        while curr_state is not None and (curr_state._path is None or curr_state._path[0] is not curr_state.goal):
+            stale.append(curr_state)
+            curr_state = curr_state.parent
+        if curr_state is None:
+            path = (None, AncestorIndex.EMPTY, 0, None)
+        else:
+            path = curr_state._path
+        for curr_state in reversed(stale):
+            goal = curr_state.goal
+            _, index, negations, tabled = path
+            path = curr_state._path = (
+                goal,
+                index.set(get_atom_key(goal.atom), curr_state),
+                negations + 1 if is_negated(goal) else negations,
+                curr_state if curr_state.table_frame is not None else tabled,
+            )
+        return path
+
     def detect_loop(self) -> str:
         goal = self.goal
-        loop_found = False
-        positive_loop = False
+        if self.parent is None:
+            return "none"
         
         # Find loop in parents
         # Constraint Answer Set Programming Without Grounding - Appendix B
-        curr_state = self.parent
-        negation_count = 0
+        # Only ancestors with the same predicate are visited (nearest first), through the ancestor index.
+        key = get_atom_key(goal.atom)
+        _, index, negations, tabled = self.parent._path_info()
+        loop_state = None
+        curr_state = index.get(key)
         while curr_state is not None:
-            if is_negated(curr_state.goal):
-                negation_count += 1
-            # Found a loop
-            if find_bindings(goal, curr_state.goal):
-                loop_found = True
+            # Found a loop: goal unifies with the ancestor, or with the ancestor with flipped sign.
+            # Both checks reduce to unifying atoms (unless double negation is involved)
+            ancestor = curr_state.goal
+            if (goal.sign == ancestor.sign or (goal.sign != Sign.DoubleNegation and ancestor.sign != Sign.DoubleNegation)) \
+                and unifiable(goal.atom, ancestor.atom):
+                loop_state = curr_state
                 break
-            elif find_bindings(goal, flip_sign(curr_state.goal)):
-                loop_found = True
-                break
-            curr_state = curr_state.parent
+            curr_state = None if curr_state.parent is None else curr_state.parent._path_info()[1].get(key)
+
+        # Report to tabled calls between this goal and the loop:
+        # a loop above them makes their answers depend on the context
+        curr_state = tabled
+        while curr_state is not None and (loop_state is None or curr_state.depth > loop_state.depth):
+            frame = curr_state.table_frame
+            if frame.active:
+                if loop_state is not None:
+                    frame.complete = False
+                else:
+                    frame.add_probe(goal.atom)
+            curr_state = None if curr_state.parent is None else curr_state.parent._path_info()[3]
+
         # Return result
-        if loop_found:
-            if negation_count > 0 and negation_count % 2 == 0:
+        if loop_state is not None:
+            # Negations from the parent up to the ancestor, inclusive
+            if loop_state.parent is not None:
+                negations -= loop_state.parent._path_info()[2]
+            if negations > 0 and negations % 2 == 0:
                 return "success"
             else:
                 return "failure"
         else:
             return "none"
 
+    def detect_regress(self) -> bool:
+        """For a parentless goal started to refute a negation: True if the same call (up to variable renaming)
+        is already being proved for an enclosing negation.
+        The new search would replay the pending one from the start, so it could never terminate."""
+        key = variant_key(self.original_goal)
+        curr_state = self.caller
+        while curr_state is not None:
+            if curr_state.parent is not None:
+                curr_state = curr_state.parent
+                continue
+            if curr_state.caller is None:
+                break
+            if variant_key(curr_state.original_goal) == key:
+                return True
+            curr_state = curr_state.caller
+        return False
+
     def __str__(self) -> str:
         return self._pprint(indent=0)
     def _pprint(self, indent: int) -> str:
@@ -135,26 +316,3 @@ class ProofState():
             string += subgoal._pprint(indent+1)
         return string
 
-    def add_proof(self, proof, rule):
-        self.proved = True
-
-        for p in proof:
-            bind(self.goal, p.bindings)
-        self.bindings = find_bindings(self.original_goal, self.goal)
-        self.rule = rule
-
-        # Co-link current state and subgoals
-        self.proof = proof
-        for subgoal_state in proof:
-            subgoal_state.parent = self
-
-    def __deepcopy__(self, memo):
-        cls = self.__class__
-        result = cls.__new__(cls)
-        memo[id(self)] = result
-        for k, v in self.__dict__.items():
-            if k in ["parent"]:
-                setattr(result, k, copy(v)) # Shallow copy to prevent infinite recursion
-            else:
-                setattr(result, k, deepcopy(v, memo))
-        return result
\ No newline at end of file
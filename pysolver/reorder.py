@@ -0,0 +1,147 @@
+from typing import List, Dict, Tuple, Callable, Set, Optional
+
+from clingo.ast import Sign
+
+from .term import Term, Func, UnaryOp, Agg, Lit, Clause
+from .rule_index import Signature, get_arguments, get_atom_key
+
+def _variables(term: Term, anonymous: bool = False) -> Set[str]:
+    # Named variables of a term (each `_` is distinct, so it never links literals and is never bound)
+    names = set()
+    term.map_vars(lambda var: names.add(var.name) or var)
+    if not anonymous:
+        names.discard("_")
+    return names
+
+def _is_positive(lit: Lit) -> bool:
+    # Positive literals of predicates bind variables; the others (negation, comparison, ...) only test them
+    atom = lit.atom
+    if atom.__class__ is UnaryOp and atom.op == "-":
+        atom = atom.arg
+    return lit.sign == Sign.NoSign and atom.__class__ is Func
+
+def _dependencies(lit: Lit) -> List[Tuple]:
+    # Predicates (atom keys) a body literal calls, whatever its sign; aggregates call their elements
+    if lit.atom.__class__ is Agg:
+        return [get_atom_key(element.atom) for element in lit.atom.elements]
+    return [get_atom_key(lit.atom)]
+
+def _strata(graph: Dict[Tuple, Set[Tuple]]) -> List[List[Tuple]]:
+    # Strongly connected components of the dependency graph (Tarjan), dependencies first
+    index: Dict[Tuple, int] = {}
+    low: Dict[Tuple, int] = {}
+    stack = []
+    on_stack = set()
+    components = []
+    for root in graph:
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(graph[root]))]
+        while len(work) > 0:
+            node, edges = work[-1]
+            for succ in edges:
+                if succ not in index:
+                    index[succ] = low[succ] = len(index)
+                    stack.append(succ)
+                    on_stack.add(succ)
+                    work.append((succ, iter(graph[succ])))
+                    break
+                elif succ in on_stack:
+                    low[node] = min(low[node], index[succ])
+            else:
+                work.pop()
+                if len(work) > 0:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+    return components
+
+def dependency_graph(rules: Dict[Signature, List[Clause]]) -> Dict[Tuple, Set[Tuple]]:
+    """Predicates (atom keys) each predicate calls in the bodies of its `rules`, whatever their sign.
+    Every predicate called is a node, with or without rules."""
+    graph: Dict[Tuple, Set[Tuple]] = {}
+    for signature_rules in rules.values():
+        for rule in signature_rules:
+            dependencies = graph.setdefault(get_atom_key(rule.head.atom), set())
+            for lit in rule.body:
+                dependencies.update(_dependencies(lit))
+    for dependencies in list(graph.values()):
+        for key in dependencies:
+            graph.setdefault(key, set())
+    return graph
+
+def recursive_components(rules: Dict[Signature, List[Clause]]) -> Dict[Tuple, int]:
+    """Strongly connected component of each predicate (atom key) of the dependency graph of `rules`.
+    A body literal calls its rule recursively iff its predicate is in the component of the head."""
+    graph = dependency_graph(rules)
+    return {key: component_id for component_id, component in enumerate(_strata(graph)) for key in component}
+
+def reorder_body(rule: Clause, count_rules: Callable[[Lit], int], components: Optional[Dict[Tuple, int]] = None) -> Tuple[int, ...]:
+    """Evaluation order of the body of `rule` (indices into `rule.body`), cheapest first.
+
+    Greedy, by binding pattern: variables of the literals placed so far count as bound. The order is shared
+    by every call of the rule, so head variables are not assumed bound (the call may leave them open).
+    - Negations, comparisons and other tests keep their position relative to every positive literal
+      they share a variable with, so they see exactly the same bindings as in the source order.
+      They are placed as soon as this allows (they only filter).
+    - Among positive literals, the one with the fewest matching rules (`count_rules`) is placed first,
+      discounted by the share of bound arguments. Ties keep the source order.
+    - Recursive calls (predicates in the component of the head, see `recursive_components`) stay after
+      every literal before them that shares a variable: called less bound, they would meet their ancestors
+      and fail by coinduction.
+    """
+    body = rule.body
+    n = len(body)
+    variables = [_variables(lit) for lit in body]
+    positive = [_is_positive(lit) for lit in body]
+    head_component = None if components is None else components.get(get_atom_key(rule.head.atom))
+    recursive = [
+        head_component is not None and any(components.get(key) == head_component for key in _dependencies(lit))
+        for lit in body
+    ]
+
+    # i must be placed before j
+    predecessors: List[Set[int]] = [set() for _ in range(n)]
+    for j in range(n):
+        for i in range(j):
+            if positive[i] and positive[j] and not recursive[j]:
+                continue # free to swap
+            if not positive[i] and not positive[j] or variables[i] & variables[j]:
+                predecessors[j].add(i)
+
+    bound: Set[str] = set()
+    order = []
+    placed = set()
+    while len(order) < n:
+        eligible = [j for j in range(n) if j not in placed and predecessors[j] <= placed]
+        tests = [j for j in eligible if not positive[j]]
+        if len(tests) > 0:
+            best = tests[0]
+        else:
+            best = min(eligible, key=lambda j: (_cost(body[j], bound, count_rules), j))
+        order.append(best)
+        placed.add(best)
+        bound |= variables[best]
+    return tuple(order)
+
+def _cost(lit: Lit, bound: Set[str], count_rules: Callable[[Lit], int]) -> float:
+    # Estimated number of proofs of `lit` under the bound variables
+    rule_count = count_rules(lit)
+    if rule_count == 0:
+        return 0 # fails at once
+    args = get_arguments(lit)
+    if len(args) == 0:
+        return rule_count
+    bound_args = sum(1 for arg in args if arg.ground or _variables(arg, anonymous=True) <= bound)
+    return rule_count ** ((len(args) - bound_args) / len(args))
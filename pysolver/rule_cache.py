@@ -0,0 +1,157 @@
+from typing import Tuple, Dict, Any
+from collections import OrderedDict
+from copy import deepcopy
+import re
+import threading
+
+from clingo.ast import AST
+
+from .utils import parse_line
+from .preprocess import preprocess_rule, get_duals
+from .term import Clause, to_term
+from .clingo_backend import clingo_statements
+
+_TOKEN = re.compile(r'"(?:\\.|[^"\\])*"|(?:%\*.*?\*%|%[^\n]*|\s)+', re.DOTALL)
+
+def normalize_rule(line: str) -> str:
+    """Cache key of a rule: runs of comments and whitespace outside string literals become a single space."""
+    return _TOKEN.sub(lambda match: match.group() if match.group()[0] == '"' else " ", line).strip()
+
+class ParsedRule():
+    """A rule line, parsed once: its AST, the preprocessed rules and their solver terms.
+    Failures are cached as well; each field raises the error of its own step.
+    The dual statements of the preprocessed rules and their clingo statements are only generated when first
+    asked for (`duals`, `clingo`).
+
+    ASTs are shared by every user of the cache: copy them before changing them.
+    """
+    __slots__ = ("_ast", "_rules", "_duals", "_terms", "_clingo", "size")
+
+    # Rough memory per character of rule text (clingo AST, preprocessed ASTs and their duals, terms), for the cache bound
+    AST_BYTES_PER_CHAR = 50
+    PREPROCESSED_BYTES_PER_CHAR = 40
+    TERM_BYTES_PER_CHAR = 30
+
+    def __init__(self, line: str):
+        self._ast = self._rules = self._terms = None
+        self._duals = self._clingo = None # generated on demand
+        try:
+            self._ast = parse_line(line)
+            self._rules = tuple(preprocess_rule(deepcopy(self._ast))) # preprocessing changes parts of its input
+            self._terms = tuple(to_term(rule) for rule in self._rules) # numeric strings already converted
+        except Exception as e:
+            # Error of the first step that failed; later steps are not reached
+            if self._ast is None:
+                self._ast = e
+            elif self._rules is None:
+                self._rules = e
+            else:
+                self._terms = e
+        size = (self.AST_BYTES_PER_CHAR + self.TERM_BYTES_PER_CHAR) * len(line)
+        if isinstance(self._rules, tuple):
+            size += self.PREPROCESSED_BYTES_PER_CHAR * sum(len(str(rule)) for rule in self._rules)
+        self.size = size
+
+    @staticmethod
+    def _get(value):
+        if isinstance(value, Exception):
+            raise value.with_traceback(None) # raised again on every use: do not pile up tracebacks
+        return value
+
+    @property
+    def ast(self) -> AST:
+        """Raises the syntax error of the line."""
+        return self._get(self._ast)
+
+    @property
+    def rules(self) -> Tuple[AST, ...]:
+        """Preprocessed rules, without duals (see `preprocess.preprocess_rule`)."""
+        self._get(self._ast)
+        return self._get(self._rules)
+
+    @property
+    def duals(self) -> Tuple[Tuple[AST, ...], ...]:
+        """Dual statements of each preprocessed rule (see `preprocess.get_duals`), generated on first use."""
+        rules = self.rules
+        if self._duals is None:
+            try:
+                self._duals = tuple(tuple(get_duals(rule)) for rule in rules)
+            except Exception as e:
+                self._duals = e
+        return self._get(self._duals)
+
+    @property
+    def preprocessed(self) -> Tuple[AST, ...]:
+        """See `preprocess.preprocess`: each rule, followed by its duals."""
+        return tuple(statement for rule, duals in zip(self.rules, self.duals) for statement in (rule,) + duals)
+
+    @property
+    def clingo(self) -> Tuple[Tuple[str, ...], bool]:
+        """Statements for clingo and whether none was dropped (see `clingo_backend.clingo_statements`), generated on first use."""
+        rules = self.rules
+        if self._clingo is None:
+            self._clingo = clingo_statements(rules)
+        return self._clingo
+
+    @property
+    def terms(self) -> Tuple[Clause, ...]:
+        """Preprocessed rules as solver terms (empty for directives)."""
+        self._get(self._ast)
+        self._get(self._rules)
+        return self._get(self._terms)
+
+class RuleCache():
+    """Process-wide LRU cache of parsed rules (`ParsedRule`), keyed by the normalized rule text.
+
+    Requests share most of their lines (the law), so those are parsed and preprocessed once.
+    The least recently used rules are evicted when the estimated size exceeds `max_bytes`.
+    """
+    def __init__(self, max_bytes: int = 64 * 2**20):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, ParsedRule]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock() # requests may be served by several threads
+
+    def get(self, line: str) -> ParsedRule:
+        key = normalize_rule(line)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        entry = ParsedRule(key) # outside the lock (slow)
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = entry
+                self.bytes += entry.size
+                self._evict()
+        return entry
+
+    def set_max_bytes(self, max_bytes: int):
+        with self.lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and len(self.entries) > 0:
+            _, entry = self.entries.popitem(last=False)
+            self.bytes -= entry.size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+rule_cache = RuleCache()
@@ -0,0 +1,125 @@
+from typing import List, Dict, Tuple, Optional
+from heapq import merge
+
+from .term import Term, Func, UnaryOp, BoolConst, Lit, Clause
+from .unify import unifiable
+
+# (sign, classical negation, name, arity)
+Signature = Tuple[int, bool, str, int]
+
+def get_signature(lit: Lit) -> Optional[Signature]:
+    """Predicate signature of a literal, e.g. `not -a(X, Y)` -> (1, True, "a", 2).
+    Returns None for literals that cannot be heads of rules (comparisons, aggregates, ...)."""
+    atom = lit.atom
+    classical_negation = False
+    if atom.__class__ is UnaryOp and atom.op == "-" and atom.arg.__class__ is Func:
+        classical_negation = True
+        atom = atom.arg
+    if atom.__class__ is Func:
+        return (lit.sign, classical_negation, atom.name, len(atom.args))
+    elif atom.__class__ is BoolConst:
+        return (lit.sign, False, str(atom), 0)
+    return None
+
+def get_atom_key(atom: Term) -> Tuple:
+    """Predicate of an atom regardless of the sign of its literal, e.g. `-a(X, Y)` -> (True, "a", 2).
+    Atoms with different keys never unify (loop checks unify atoms of both signs)."""
+    if atom.__class__ is UnaryOp and atom.op == "-" and atom.arg.__class__ is Func:
+        return (True, atom.arg.name, len(atom.arg.args))
+    elif atom.__class__ is Func:
+        return (False, atom.name, len(atom.args))
+    return (atom.__class__,) # comparisons, #true/#false, ...
+
+def get_arguments(lit: Lit) -> Tuple[Term, ...]:
+    atom = lit.atom
+    if atom.__class__ is UnaryOp:
+        atom = atom.arg
+    if atom.__class__ is Func:
+        return atom.args
+    return ()
+
+class _ArgumentIndex():
+    # Secondary index on a single argument position.
+    # Rule ids are appended in insertion order, so every bucket is sorted.
+    __slots__ = ("ground", "functor", "other")
+
+    def __init__(self):
+        self.ground: Dict[Term, List[int]] = {} # argument is a ground term
+        self.functor: Dict[Tuple[str, int], List[int]] = {} # argument is a non-ground function, e.g. f(X)
+        self.other: List[int] = [] # variables and everything else (match any goal argument)
+
+    def add(self, arg: Term, rule_id: int):
+        if arg.ground:
+            self.ground.setdefault(arg, []).append(rule_id)
+        elif arg.__class__ is Func:
+            self.functor.setdefault((arg.name, len(arg.args)), []).append(rule_id)
+        else:
+            self.other.append(rule_id)
+
+    def candidates(self, arg: Term) -> Optional[List[List[int]]]:
+        # Buckets of rules that may unify with a ground goal argument `arg`; None if `arg` cannot filter
+        if not arg.ground:
+            return None
+        buckets = [self.ground.get(arg, []), self.other]
+        if arg.__class__ is Func and len(arg.args) > 0:
+            buckets.append(self.functor.get((arg.name, len(arg.args)), []))
+        return buckets
+
+class RuleIndex():
+    """Clause store for `ProofContext`.
+
+    Rules are grouped by head signature (sign, classical negation, name, arity).
+    Within a signature, every argument position has a hash index on ground arguments,
+    so a goal like `guilty(defendant("A"), crime("X"), _)` only touches rules whose constants match.
+    Candidates are returned in insertion order.
+    """
+    def __init__(self):
+        self.rules: Dict[Signature, List[Clause]] = {}
+        self.arg_index: Dict[Signature, List[_ArgumentIndex]] = {}
+
+    def __len__(self):
+        return sum(len(rules) for rules in self.rules.values())
+
+    def add(self, rule: Clause) -> bool:
+        signature = get_signature(rule.head)
+        if signature is None:
+            return False # cannot be retrieved by any goal
+        if signature not in self.rules:
+            self.rules[signature] = []
+            self.arg_index[signature] = [_ArgumentIndex() for _ in range(signature[3])]
+        rules = self.rules[signature]
+        rule_id = len(rules)
+        rules.append(rule)
+        for arg, arg_index in zip(get_arguments(rule.head), self.arg_index[signature]):
+            arg_index.add(arg, rule_id)
+        return True
+
+    def count(self, goal: Lit) -> int:
+        """Number of rules with the signature of `goal`."""
+        return len(self.rules.get(get_signature(goal), ()))
+
+    def candidates(self, goal: Lit) -> List[Clause]:
+        """Rules that might unify with `goal` (filtered by signature and ground arguments only)."""
+        signature = get_signature(goal)
+        rules = self.rules.get(signature)
+        if rules is None:
+            return []
+        # Pick the most selective argument position
+        best = None
+        best_size = len(rules)
+        for arg, arg_index in zip(get_arguments(goal), self.arg_index[signature]):
+            buckets = arg_index.candidates(arg)
+            if buckets is None:
+                continue
+            size = sum(len(bucket) for bucket in buckets)
+            if size < best_size:
+                best, best_size = buckets, size
+                if size == 0:
+                    return []
+        if best is None:
+            return rules
+        return [rules[rule_id] for rule_id in merge(*best)]
+
+    def find(self, goal: Lit) -> List[Clause]:
+        """Rules whose head unifies with `goal` (arithmetic in heads possibly, see `Substitution.unify_deferring`)."""
+        return [rule for rule in self.candidates(goal) if unifiable(rule.head, goal, defer_arithmetic=True)]
@@ -1,27 +1,57 @@
 from typing import *
 
 from .utils import parse_line, parse_program
-from .solve import solve
-from .proof_state import ProofContext
+from .solve import solve, iter_solve, prove_false, InfiniteRegress
+from .proof_state import ProofContext, ProofState
+from .budget import SolverBudget, BudgetExceeded
+from .parallel import OrParallel
 from .justification_tree import *
 import logging
 
-def get_proof_tree(program: List[Dict[str, Any]], goal: AST) -> JustificationTree:
-    logging.debug(f"?- {str(goal)}.")
+class CompiledProgram():
+    """A program parsed, preprocessed and indexed once, to answer many goals
+    (e.g. every conclusion of a request, their negations and `#false`).
+    Queries share the context, so the consistency check runs once.
 
-    context = ProofContext()
-    for line in program:
-        context.add_rule(line)
+    Lines that cannot be compiled are skipped; `errors[i]` holds the exception of line i (None if compiled).
+    With `reorder_body`, rule bodies are evaluated in a cheaper order than written,
+    and with `materialize`, the negation-free part of the program is derived bottom-up once (see `ProofContext`).
+    """
+    def __init__(self, program: List[Dict[str, Any]], reorder_body: bool = False, materialize: bool = False):
+        self.program = program
+        self.context = ProofContext(reorder_body=reorder_body, materialize=materialize)
+        self.errors: List[Optional[Exception]] = []
+        for line in program:
+            try:
+                self.context.add_rule(line)
+                self.errors.append(None)
+            except Exception as e:
+                self.errors.append(e)
+
+    def solve(self, goal: AST, tabling=False, limit: int = None, budget: SolverBudget = None, parallel: OrParallel = None) -> List[ProofState]:
+        logging.debug(f"?- {str(goal)}.")
+        return solve(goal, self.context, tabling=tabling, limit=limit, budget=budget, parallel=parallel) # `limit=1`: stop after the first proof
+
+    def get_proof_tree(self, goal: AST, tabling=False, limit: int = None, budget: SolverBudget = None, parallel: OrParallel = None) -> JustificationTree:
+        proofs = self.solve(goal, tabling=tabling, limit=limit, budget=budget, parallel=parallel)
+
+        # Parse and merge trees
+        if len(proofs) > 0:
+            tree = JustificationTree(proofs)
+        else:
+            tree = None
+            # print([str(x) for x in get_unproved_goals(program, goal)])
+        return tree
 
-    proofs = solve(goal, context)
+    def prove_false(self, budget: SolverBudget = None) -> ProofState:
+        # Proof of `#false`, if the program is inconsistent (cached)
+        return prove_false(self.context, budget)
 
-    # Parse and merge trees
-    if len(proofs) > 0:
-        tree = JustificationTree(proofs)
-    else:
-        tree = None
-        # print([str(x) for x in get_unproved_goals(program, goal)])
-    return tree
+def get_proof_tree(program: List[Dict[str, Any]], goal: AST, tabling=False, limit: int = None, budget: SolverBudget = None, parallel: OrParallel = None) -> JustificationTree:
+    # program: rules, or a `CompiledProgram` to query several goals without compiling again
+    if not isinstance(program, CompiledProgram):
+        program = CompiledProgram(program)
+    return program.get_proof_tree(goal, tabling=tabling, limit=limit, budget=budget, parallel=parallel)
 
 
 def get_unproved_goals(program: List[Dict[str, Any]], goal: AST) -> List[AST]:
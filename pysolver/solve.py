@@ -1,5 +1,6 @@
-from typing import List, Dict
-from copy import deepcopy
+from typing import List, Iterator, Tuple, Generator
+from types import GeneratorType
+from itertools import islice
 import logging
 
 from clingo.ast import *
@@ -7,34 +8,113 @@ from clingo.control import *
 from clingo.symbol import *
 from clingo.solving import *
 
-from .utils import get_hash_head, is_negated, is_ground, flip_sign, UnprovedGoalState, parse_line
-from .unify import find_bindings, bind
+from .utils import is_negated, flip_sign, UnprovedGoalState, parse_line
+from .unify import Substitution, unifiable
 from .proof_state import ProofContext, ProofState
+from .term import Lit, Cmp, Agg, Clause, to_term, numeric_value
+from .tabling import AnswerTable
+from .constraints import ConstraintStore, HEAD, is_assignment
+from .budget import SolverBudget, BudgetExceeded
+from .parallel import OrParallel
 
-def consistency_check(context: ProofContext):
-    false_lit = parse_line("#false.").head # retrieve literal `#false`
-    if len(context.find_rule(false_lit)) == 0:
-        return True
-    if recursive_solve(ProofState(false_lit), context):
-        return False
-    return True
+class InfiniteRegress(Exception):
+    """Raised when refuting a negation would replay a pending refutation of the same call forever,
+    e.g. `?- a.` with `a :- not b. b :- not a.` (see `ProofState.detect_regress`)."""
 
-def solve(goal: AST, context: ProofContext, unproved_callback=None) -> List[ProofState]:
+def prove_false(context: ProofContext, budget: SolverBudget = None) -> ProofState:
+    """Proof of `#false` (None if the program is consistent).
+    The result is cached on the context until the program changes, so queries on the same context check it once."""
+    if context.consistency is not None and context.consistency[0] == context.fingerprint:
+        return context.consistency[1]
+    false_lit = to_term(parse_line("#false.").head) # retrieve literal `#false`
+    proof = None
+    if len(context.find_rule(false_lit)) > 0:
+        proof = next(run_search(ProofState(false_lit), context, budget=budget), None) # a single proof of `#false` is enough
+    context.consistency = (context.fingerprint, proof) # not reached if the budget is exceeded
+    return proof
+
+def consistency_check(context: ProofContext, budget: SolverBudget = None):
+    return prove_false(context, budget) is None
+
+def iter_solve(goal: Lit, context: ProofContext, unproved_callback=None, tabling=False, budget: SolverBudget = None, parallel: OrParallel = None) -> Iterator[ProofState]:
+    """Prove `goal` lazily, yielding proofs as they are found.
+    Stop iterating to abandon the rest of the search (e.g. after the first proof).
+
+    With `tabling`, answers are memoized per call variant within this invocation (see `tabling.AnswerTable`).
+    Tabling is disabled when `unproved_callback` is given, since the callback may change the program.
+
+    With `budget`, the search stops when a limit is exceeded; proofs yielded so far are complete,
+    and `budget.exceeded` tells that the result is partial.
+
+    With `parallel`, alternative rules of shallow goals are tried in worker processes (see `parallel.OrParallel`).
+    """
     # print(f"Start proof for {goal}")
+    if isinstance(goal, AST):
+        goal = to_term(goal)
+    if budget is not None:
+        budget.start()
 
-    # Consistency check
-    if not consistency_check(context):
-        return []
-    
-    # Depth-first search (with explicit state) for a vaild proof
-    root = ProofState(deepcopy(goal))
-    result = recursive_solve(root, context, unproved_callback)
-    return result
+    try:
+        # Consistency check
+        if not consistency_check(context, budget):
+            return
+        
+        # Depth-first search (with explicit state) for a vaild proof
+        root = ProofState(goal)
+        table = AnswerTable() if tabling and unproved_callback is None else None
+        if table is not None or unproved_callback is not None:
+            parallel = None # branches would not share the table / callback effects
+        yield from run_search(root, context, unproved_callback, table, budget, parallel)
+        if table is not None:
+            logging.debug(f"Tabling: {table.hits} hits, {table.misses} misses")
+    except BudgetExceeded as e:
+        logging.warning(f"?- {goal}. {str(e)} {budget.stats()}")
 
+def solve(goal: Lit, context: ProofContext, unproved_callback=None, tabling=False, limit: int = None, budget: SolverBudget = None, parallel: OrParallel = None) -> List[ProofState]:
+    """Prove `goal` and return the first `limit` proofs (every proof if `limit` is None). See `iter_solve`."""
+    return list(islice(iter_solve(goal, context, unproved_callback, tabling, budget, parallel), limit))
 
-def recursive_solve(state: ProofState, context: ProofContext, unproved_callback = None) -> List[ProofState]:
+
+##### Search engine #####
+# The search runs on an explicit stack instead of Python recursion, so the proof depth is bounded by memory.
+# Each frame is a generator that yields either
+# - a child frame (generator): request the next answer of the child; the driver sends back the answer, or None if exhausted
+# - any other value: an answer for the parent frame
+# Frames are resumed only by the driver (`_run`), never by each other.
+
+def run_search(state: ProofState, context: ProofContext, unproved_callback = None, table: AnswerTable = None, budget: SolverBudget = None, parallel: OrParallel = None) -> Iterator[ProofState]:
+    """Yield proofs of `state.goal` lazily. Stop iterating to abandon (or keep the iterator to resume) the search."""
+    return _run(_solve_state(state, context, unproved_callback, table, budget, parallel))
+
+def _run(root: Generator) -> Iterator:
+    stack = [root]
+    value = None
+    while True:
+        try:
+            output = stack[-1].send(value)
+        except StopIteration:
+            stack.pop()
+            if len(stack) == 0:
+                return
+            value = None # child exhausted
+            continue
+        if output.__class__ is GeneratorType:
+            # Call (or resume) a child frame
+            stack.append(output)
+            value = None
+        elif len(stack) == 1:
+            yield output # answer of the root frame
+            value = None
+        else:
+            # Return an answer to the parent; the child stays suspended in the parent's hands
+            stack.pop()
+            value = output
+
+def _solve_state(state: ProofState, context: ProofContext, unproved_callback = None, table: AnswerTable = None, budget: SolverBudget = None, parallel: OrParallel = None) -> Generator:
     # state: pointer to the current goal in the full proof
-    goal = state.goal
+    # Frame: proofs are produced on demand, so callers can stop after the first one
+    if budget is not None:
+        budget.expand(state.depth) # raises BudgetExceeded
 
     ##### 1. Check coinduction (loop in proofs) #####
     result_str = state.detect_loop()
@@ -42,172 +122,296 @@ def recursive_solve(state: ProofState, context: ProofContext, unproved_callback
         # Goal is grounded & already proved in state (coinduction success)
         # print("Coinduction success")
         state.proved = True
-        return [state]
+        yield state
+        return
     elif result_str == "failure": # 0 or odd>=1 negations
         # Goal clashes with other proved goal (coinduction failure)
         # print("Coinduction failure")
-        return []
+        return
     else: # result == "none"
         # Neither coinduction success or failure
         pass
 
+    ##### 1-1. Reuse answers of a completed call variant #####
+    if table is None:
+        yield from _solve_goal(state, context, unproved_callback, table, budget, parallel)
+        return
+    answers = table.lookup(state, context)
+    if answers is not None:
+        yield from answers
+        return
+    frame = table.enter(state)
+    proved_states = []
+    child = _solve_goal(state, context, unproved_callback, table, budget, parallel)
+    while (proof := (yield child)) is not None:
+        proved_states.append(proof)
+        yield proof
+    # Only reached if every proof was consumed (complete evaluation)
+    table.exit(state, frame, proved_states)
+
+def _solve_goal(state: ProofState, context: ProofContext, unproved_callback = None, table: AnswerTable = None, budget: SolverBudget = None, parallel: OrParallel = None) -> Generator:
+    # Steps after the coinduction check
+    goal = state.goal
+
     ##### 2. Check coinduction (loop in proofs) #####
-    if goal.atom.ast_type == ASTType.Comparison:
-        if not is_ground(goal):
+    if goal.atom.__class__ is Cmp:
+        if not goal.ground and not is_assignment(goal):
             # Comparison goal not grounded -> fail to prove anything
-            return []
+            return
         # Decompose comparison
-        # (lterm) (guard (op) (rterm))
-        lterm = goal.atom.term
-        assert len(goal.atom.guards) == 1
-        guard = goal.atom.guards[0]
-        op = guard.comparison
-        rterm = guard.term
-        if op == ComparisonOperator.Equal:
+        # (lterm) (op) (rterm)
+        op = goal.atom.op
+        lterm = goal.atom.left
+        rterm = goal.atom.right
+        if op == "=":
             # Equal : treat with `unify`
-            bindings = find_bindings(lterm, rterm)
-            if bindings is not None:
-                state = deepcopy(state)
-                state.bind(bindings)
+            substitution = Substitution()
+            if substitution.unify(lterm, rterm):
+                if budget is not None:
+                    budget.new_state()
+                state = state.copy(substitution.resolve(state.goal))
                 state.proved = True # Bind two literals
-                return [state]
-        elif op == ComparisonOperator.NotEqual:
-            bindings = find_bindings(lterm, rterm)
-            if bindings is None:
+                yield state
+                return
+        elif op == "!=":
+            if not unifiable(lterm, rterm):
                 state.proved = True # Bind two literals
-                return [state]
+                yield state
+                return
         else:
-            # Greater/Less : only make sense if ground integers are compared
-            # print(lterm.__class__, lterm.ast_type)
-            lterm = lterm.symbol # Extract clingo.Symbol values
-            rterm = rterm.symbol
-            # Only compare numbers
-            if not lterm.type == rterm.type == SymbolType.Number:
+            # Greater/Less : only make sense if ground integers (or numeric strings) are compared
+            lvalue = numeric_value(lterm)
+            rvalue = numeric_value(rterm)
+            if lvalue is None or rvalue is None:
                 raise ValueError(f"Non-integer literals ({lterm}, {rterm}) cannot be compared")
-            if op == ComparisonOperator.GreaterThan and lterm.number > rterm.number or \
-               op == ComparisonOperator.GreaterEqual and lterm.number >= rterm.number or \
-               op == ComparisonOperator.LessThan and lterm.number < rterm.number or \
-               op == ComparisonOperator.LessThan and lterm.number <= rterm.number:
-                    state.proved = True
-                    return [state]
+            if goal.atom.test(lvalue, rvalue):
+                state.proved = True
+                yield state
+                return
         # Comparison clear!!
 
+    ##### 2-1. Disjunctive body element (`1 <= {a; b; c}`, read as `a or b or c`) #####
+    if goal.atom.__class__ is Agg:
+        # OR-node: a branch per element, each proof shows the element it took.
+        # Dual (`not 1 <= {a; b; c}`): AND-node `not a, not b, not c`, with a proof for each.
+        # The rules are built from the goal itself: no fresh variables needed
+        elements = goal.atom.elements
+        if goal.sign != Sign.Negation:
+            rules = [Clause(goal, (element,)) for element in elements]
+        else:
+            rules = [Clause(goal, tuple(flip_sign(element) for element in elements))]
+        yield from _apply_rules(state, rules, context, unproved_callback, table, budget, parallel, fresh=False)
+        return
+
     ##### 3. Check classic negation (not x) #####
     if is_negated(goal):
-        new_goal = deepcopy(state.goal)
-        new_goal.sign = Sign.NoSign
-        new_proved_states = recursive_solve(ProofState(new_goal), context, unproved_callback)
-        if len(new_proved_states) >= 1:
+        new_state = ProofState(Lit(Sign.NoSign, state.goal.atom))
+        new_state.depth = state.depth + 1
+        new_state.caller = state
+        if unproved_callback is None and new_state.detect_regress():
+            # Deterministic replay of a pending search (also with tabling: answers are only tabled once complete)
+            raise InfiniteRegress(f"Infinite regress while refuting {goal}")
+        # A single proof of x is enough to refute `not x`
+        if (yield _solve_state(new_state, context, unproved_callback, table, budget, parallel)) is not None:
             # TODO add callback for trace failure
             # print(goal, "failed because", new_goal, "is proved")
-            return []
+            return
         else:
             # print(goal, "suceeded because", new_goal, "cannot be proved")
             pass
 
     ##### 4. Check rules and facts #####
-    
-    proved_states = [] # result list
+
+    # Predicates materialized bottom-up: look up the derived facts
+    derived = context.find_derived(goal, budget) if unproved_callback is None else None
+    if derived is not None:
+        for proof in derived:
+            if budget is not None:
+                budget.new_state()
+            state.proved = True
+            yield state.with_proof(proof.goal, proof.proof, proof.rule)
+        return
 
     # Head is plain literal(function, const, ..) -> Find relevant rules
     rules = context.find_rule(goal)
-    original_state = state # preserve original state to prevent mix between rules
-    is_any_rule_unified = len(rules) > 0
+    is_any_rule_unified = len(rules) > 0 # find_rule only returns rules that unify with goal
+
+    if unproved_callback is None:
+        yield from _apply_rules(state, rules, context, unproved_callback, table, budget, parallel) # sets `state.proved`
+        # handle negation: if reach here, it is true
+        if is_negated(goal) and not is_any_rule_unified:
+            # not x
+            # where x does not exists
+            state.proved = True
+            yield state
+        return
+
+    # With callbacks, collect every proof first: the callback decides whether to re-run the proof
+    proved_states = []
+    child = _apply_rules(state, rules, context, unproved_callback, table, budget)
+    while (proof := (yield child)) is not None:
+        proved_states.append(proof)
+    # handle negation: if reach here, it is true
+    if is_negated(goal) and not is_any_rule_unified:
+        # not x
+        # where x does not exists
+        state.proved = True
+        proved_states.append(state)
+
+    ##### 5. Post-tasks: add to cache, failure callback #####
+
+    # Track unproved goals by callback
+    call_parent = False
+    if not state.proved:
+        if not is_any_rule_unified:
+            call_parent = unproved_callback(state, UnprovedGoalState.UNPROVED_YET) # No rules that unify with a positive goal
+        else:
+            call_parent = unproved_callback(state, UnprovedGoalState.BACKTRACK) # Despite rules exist, 
+    elif state.proved and is_negated(state.goal) and not is_any_rule_unified:
+        # `not x` is proved because `x` cannot be proved
+        flipped_state = state.copy(flip_sign(state.goal))
+        call_parent = unproved_callback(flipped_state, UnprovedGoalState.NOT_EXIST) # Although `not x` is considered as proved, need to check x
+    
+    # Since unproved_callback can modify global context (rule_index, replay consistency check, ...)
+    # ex.
+    #   - context.add_rule(rule)
+    # Re-run the search with current goal
+    if call_parent:
+        proved_states = []
+        child = _solve_state(state, context, unproved_callback, budget=budget)
+        while (proof := (yield child)) is not None:
+            proved_states.append(proof)
+
+    yield from proved_states
+
+def _apply_rules(original_state: ProofState, rules: List[Clause], context: ProofContext, unproved_callback=None, table: AnswerTable = None, budget: SolverBudget = None, parallel: OrParallel = None, fresh: bool = True) -> Generator:
+    # original_state is preserved to prevent mix between rules
+    # fresh=False: rules built for this goal (see step 2-1), used as they are (no renaming, source order)
+    goal = original_state.goal
+
+    if parallel is not None and parallel.applies(original_state, rules):
+        # Branches are independent: prove each rule in a worker
+        for proofs in parallel.apply_rules(original_state, rules, context, budget):
+            for proof in proofs:
+                original_state.proved = True
+                yield proof
+        return
 
     # apply rules recursively
     for rule in rules:
-        # Check if goal unifies with rule head, and get variable mapping
-        rule = context.reindex_variables(rule)
+        order = None
+        if fresh:
+            order = context.get_body_order(rule) # evaluation order of the body (None: source order)
+            # Check if goal unifies with rule head, and get variable mapping
+            rule = context.reindex_variables(rule)
 
-        bindings = find_bindings(goal, rule.head)
-        if bindings is None:
+        substitution = Substitution() # bindings for this rule application
+        deferred = substitution.unify_deferring(goal, rule.head)
+        if deferred is None:
             continue # unification failure(rule head does not match current goal)
-        else:
-            is_any_rule_unified = True
+        # Comparisons reached before their variables are bound wait in a constraint store (created on demand),
+        # as do the equalities of arithmetic head arguments (`days(D*7)` called as `days(14)`) until D is bound
+        store = None
+        if len(deferred) > 0:
+            store = ConstraintStore()
+            for left, right in deferred:
+                store.suspend(HEAD, Lit(Sign.NoSign, Cmp("=", left, right)))
+            if not store.consistent(substitution) or len(rule.body) == 0 and store.settle([], substitution) is None:
+                continue
         # State base to proof
-        state = deepcopy(original_state)
-        bind(state.goal, bindings)
+        if budget is not None:
+            budget.new_state()
+        state = original_state.copy(substitution.resolve(goal))
         state.rule = rule
 
         # Add binding information created by rules
         if len(rule.body) == 0:
             # fact, without rule body
-            state.add_proof([], rule)
-            proved_states.append(state)
-        else: # len(rule.body) >= 1
-            # Recursively apply the rules
-            # Set new goal and register to current state
-            
-            # Variable naming convention
-            # target_state          subset  bodygoal  (not yet seen)
-            # a               :-    b,      c,        d.
-            # iter1. subset: [], bodygoal: b
-            # iter2. subset: [b], bodygoal: c
-            # iter3. subset: [b, c], bodygoal: d
-
-            body_subset_proofs = [(state, [])]
-            for i in range(len(rule.body)):
-                bodygoal = deepcopy(rule.body[i])
-
-                new_body_subset_proofs = []
-                for target_state, subset_proof in body_subset_proofs:
-                    curr_bodygoal = deepcopy(bodygoal)
-                    # bind to current bindings
-                    bind(curr_bodygoal, bindings)
-                    for subset_state in subset_proof:
-                        bind(curr_bodygoal, subset_state.bindings)
-                    # Prove partially bound subgoals
-                    new_state = ProofState(curr_bodygoal)
-                    new_state.parent = state
-                    new_state_proofs = recursive_solve(new_state, context, unproved_callback)
-
-                    # Extend subset (list of already proven goals) with fresh proved goal
-                    for new_proof in new_state_proofs: # Each ProofStates contain single binding
-                        # deepcopy to prevent crashing
-                        new_target_state = deepcopy(target_state)
-                        new_curr_proof = subset_proof + [new_proof] # Extend subset
-                        new_body_subset_proofs.append((new_target_state, new_curr_proof))
-                # update body_subset_proofs
-                body_subset_proofs = new_body_subset_proofs
-            
-            for target_state, proof in body_subset_proofs:
-                target_state.add_proof(proof, rule)
-                proved_states.append(target_state)
-                
-    # Recover original state
-    state = original_state
-    
-    # proved!
-    if len(proved_states) > 0:
-        state.proved = True
-    # handle negation: if reach here, it is true
-    if is_negated(goal) and not is_any_rule_unified:
-        # not x
-        # where x does not exists
-        state.proved = True
-        proved_states.append(state)
+            original_state.proved = True
+            yield state.with_proof(state.goal, (), rule)
+            continue
 
-    ##### 5. Post-tasks: add to cache, failure callback #####
+        # Prove the body goals from left to right, with a choice point (child frame) per body goal
+        # state                 subset  bodygoal  (not yet seen)
+        # a               :-    b,      c,        d.
+        # i=0. subset: [], bodygoal: b
+        # i=1. subset: [b], bodygoal: c
+        # i=2. subset: [b, c], bodygoal: d
+        # Bindings from proved body goals are recorded on the substitution trail,
+        # and undone before trying the next proof of the same body goal.
+        body = rule.body if order is None else tuple(rule.body[j] for j in order)
+        bodygoals = [None] * len(body)
+        children = [None] * len(body)
+        marks = [0] * len(body)
+        subset_proof = []
+        i = 0
+        while i >= 0:
+            if children[i] is None:
+                # bind to current bindings, and prove partially bound subgoals
+                bodygoals[i] = substitution.resolve(body[i])
+                new_state = ProofState(bodygoals[i])
+                new_state.parent = state
+                new_state.depth = state.depth + 1
+                if bodygoals[i].atom.__class__ is Cmp and not bodygoals[i].ground:
+                    if store is None:
+                        store = ConstraintStore()
+                    if is_assignment(bodygoals[i]):
+                        children[i] = _solve_state(new_state, context, unproved_callback, table, budget, parallel)
+                    else:
+                        store.suspend(i, bodygoals[i])
+                        children[i] = _suspend(new_state)
+                else:
+                    children[i] = _solve_state(new_state, context, unproved_callback, table, budget, parallel)
+            new_proof = yield children[i] # Each ProofStates contain single binding
+            if new_proof is None:
+                # Backtrack to the previous body goal
+                children[i] = None
+                if store is not None:
+                    store.resume(i)
+                i -= 1
+                if i >= 0:
+                    substitution.undo(marks[i])
+                    subset_proof.pop()
+                continue
+            # Extend subset (list of already proven goals) with fresh proved goal
+            marks[i] = substitution.mark()
+            if not substitution.unify(bodygoals[i], new_proof.goal):
+                # The proved goal does not fit the body literal (e.g. an aggregate element bound elsewhere)
+                continue
+            if store is not None and len(store) > 0 and not store.consistent(substitution):
+                # Wakes the suspended comparisons: the new bindings violate one of them
+                substitution.undo(marks[i])
+                continue
+            subset_proof.append(new_proof)
+            if i + 1 < len(body):
+                i += 1
+                continue
+            # Every body goal is proved
+            body_proof = subset_proof
+            if store is not None:
+                body_proof = store.settle(subset_proof, substitution)
+                if body_proof is None:
+                    # Comparisons whose variables are still unbound fail
+                    substitution.undo(marks[i])
+                    subset_proof.pop()
+                    continue
+            if budget is not None:
+                budget.new_state()
+            proof = tuple(body_proof) if order is None else _source_order(body_proof, order)
+            original_state.proved = True
+            yield state.with_proof(substitution.resolve(state.goal), proof, rule) # shares the subproofs
+            substitution.undo(marks[i])
+            subset_proof.pop()
 
-    # Track unproved goals by callback
-    if unproved_callback is not None:
-        call_parent = False
-        if not state.proved:
-            if not is_any_rule_unified:
-                call_parent = unproved_callback(state, UnprovedGoalState.UNPROVED_YET) # No rules that unify with a positive goal
-            else:
-                call_parent = unproved_callback(state, UnprovedGoalState.BACKTRACK) # Despite rules exist, 
-        elif state.proved and is_negated(state.goal) and not is_any_rule_unified:
-            # `not x` is proved because `x` cannot be proved
-            flipped_state = deepcopy(state)
-            flipped_state.goal = flip_sign(flipped_state.goal)
-            call_parent = unproved_callback(flipped_state, UnprovedGoalState.NOT_EXIST) # Although `not x` is considered as proved, need to check x
-        
-        # Since unproved_callback can modify global context (rule_dict, replay consistency check, ...)
-        # ex.
-        #   - context.add_rule(rule)
-        # Re-call recursive_solve() with current goal
-        if call_parent:
-            proved_states = recursive_solve(state, context, unproved_callback)
-
-    return proved_states
\ No newline at end of file
+def _suspend(state: ProofState) -> Generator:
+    # Frame of a suspended comparison (see `constraints.ConstraintStore`): a placeholder proof, replaced
+    # by the ground comparison once the body is proved
+    state.proved = True
+    yield state
+
+def _source_order(subset_proof: List[ProofState], order: Tuple[int, ...]) -> Tuple[ProofState, ...]:
+    # Proofs of a reordered body, back in the order of `rule.body` (for justifications)
+    proof = [None] * len(order)
+    for i, j in enumerate(order):
+        proof[j] = subset_proof[i]
+    return tuple(proof)
@@ -0,0 +1,113 @@
+from typing import List, Dict, Tuple, Optional
+
+from .term import Term, Var, Lit
+from .unify import Substitution, unifiable
+from .rule_index import get_atom_key
+
+def variant_key(goal: Lit) -> Lit:
+    """Canonical representative of a call variant: variables are renamed by first occurrence.
+    `p(X_3, a, Y_1, X_3)` and `p(Z, a, W, Z)` share the key `p(_V0, a, _V1, _V0)`."""
+    if goal.ground:
+        return goal
+    names: Dict[str, Var] = {}
+    def rename(var: Var) -> Var:
+        new_var = names.get(var.name)
+        if new_var is None:
+            new_var = names[var.name] = Var(f"_V{len(names)}")
+        return new_var
+    return goal.map_vars(rename)
+
+class TableFrame():
+    """Bookkeeping for a tabled call that is being evaluated.
+
+    `ProofState.detect_loop` reports to every active frame it walks past:
+    - a loop found above the frame makes the call context-dependent (`complete = False`), so it is not tabled
+    - a loop check that found nothing is kept as a probe; the answers are only reused at call sites
+      where no probe unifies with an ancestor, i.e. where every loop check would give the same result
+    """
+    __slots__ = ("active", "complete", "probes")
+
+    def __init__(self):
+        self.active = True
+        self.complete = True
+        self.probes: Dict[Tuple, set] = {}
+
+    def add_probe(self, atom: Term):
+        self.probes.setdefault(get_atom_key(atom), set()).add(atom)
+
+    def add_probes(self, probes: Dict[Tuple, set]):
+        for key, atoms in probes.items():
+            self.probes.setdefault(key, set()).update(atoms)
+
+class AnswerTable():
+    """Answer tables for call variants within a single `solve` invocation.
+
+    A call variant is evaluated once; when the evaluation completes without depending on
+    goals above it (see `TableFrame`), its proofs are stored and later calls of the same variant
+    reuse them instead of proving the subgoal again.
+    """
+    def __init__(self):
+        # variant key -> (called goal, proved states, probes)
+        self.answers: Dict[Lit, Tuple[Lit, Tuple, Dict[Tuple, set]]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self.answers.clear()
+
+    def enter(self, state) -> TableFrame:
+        frame = TableFrame()
+        state.table_frame = frame
+        return frame
+
+    def exit(self, state, frame: TableFrame, proved_states: List) -> None:
+        frame.active = False
+        if frame.complete:
+            self.answers[variant_key(state.goal)] = (state.goal, tuple(proved_states), frame.probes)
+
+    def lookup(self, state, context) -> Optional[List]:
+        entry = self.answers.get(variant_key(state.goal))
+        if entry is None:
+            self.misses += 1
+            return None
+        goal, answers, probes = entry
+
+        # Check if the answers are valid under the ancestors of this call site
+        passed_frames = []
+        curr_state = state.parent
+        while curr_state is not None:
+            candidates = probes.get(get_atom_key(curr_state.goal.atom), ())
+            for atom in candidates:
+                if unifiable(atom, curr_state.goal.atom):
+                    self.misses += 1
+                    return None # a subgoal would detect a loop here: prove again
+            if curr_state.table_frame is not None and curr_state.table_frame.active:
+                passed_frames.append(curr_state.table_frame)
+            curr_state = curr_state.parent
+        # Enclosing tabled calls now depend on the same probes
+        for frame in passed_frames:
+            frame.add_probes(probes)
+        self.hits += 1
+
+        # Rename answers from the tabled call to this call
+        renaming = Substitution()
+        renaming.unify(goal, state.goal)
+        call_vars = set()
+        state.goal.map_vars(lambda var: call_vars.add(var.name) or var)
+        variable_index = context.variable_index
+        context.variable_index += 1
+        def rename(var: Var) -> Var:
+            var = renaming.deref(var)
+            if var.__class__ is not Var or var.name in call_vars:
+                return var
+            return Var(f"{var.name}_{variable_index}") # fresh variable for this call site
+
+        result = []
+        for answer in answers:
+            answer = answer.copy(answer.goal.map_vars(rename)) # shares the subproofs
+            answer.original_goal = state.original_goal
+            answer.parent = state.parent
+            result.append(answer)
+        if len(result) > 0:
+            state.proved = True
+        return result
@@ -0,0 +1,591 @@
+from typing import Tuple, Dict, Optional, Callable
+import operator
+import sys
+
+from clingo.ast import AST, ASTType
+from clingo.symbol import Symbol, SymbolType
+
+# Immutable, hash-consed term layer for the solver.
+# Clingo ASTs are converted once (see `to_term`), then the solver only works on these nodes.
+# Nodes are never mutated after construction: share them freely instead of copying.
+# - Constants (numbers, strings, nullary functions) are interned, so equal constants are identical objects
+# - Functor names are interned strings
+# - Every node stores its hash and groundness at construction time
+
+COMPARISON_OPERATOR = {
+    0: ">",   # GreaterThan
+    1: "<",   # LessThan
+    2: "<=",  # LessEqual
+    3: ">=",  # GreaterEqual
+    4: "!=",  # NotEqual
+    5: "=",   # Equal
+}
+UNARY_OPERATOR = {
+    0: "-",  # Minus
+    1: "~",  # Negation
+    2: "|",  # Absolute
+}
+BINARY_OPERATOR = {
+    0: "^",  # XOr
+    1: "?",  # Or
+    2: "&",  # And
+    3: "+",  # Plus
+    4: "-",  # Minus
+    5: "*",  # Multiplication
+    6: "/",  # Division
+    7: "\\", # Modulo
+    8: "**", # Power
+}
+
+class Term():
+    __slots__ = ("_hash", "ground")
+
+    def __hash__(self):
+        return self._hash
+    def __copy__(self):
+        return self # immutable
+    def __deepcopy__(self, memo):
+        return self # immutable
+    def __repr__(self):
+        return f"{self.__class__.__name__}({str(self)!r})"
+
+    def substitute(self, bindings: Dict[str, "Term"]) -> "Term":
+        """Replace variables by `bindings` (name -> term). Returns a new term; `self` is unchanged."""
+        raise NotImplementedError()
+    def map_vars(self, function: Callable[["Var"], "Term"]) -> "Term":
+        """Replace every variable occurrence (left-to-right) with `function(var)`."""
+        raise NotImplementedError()
+
+##### Terms #####
+
+class Var(Term):
+    __slots__ = ("name",)
+    def __init__(self, name: str):
+        self.name = sys.intern(name)
+        self.ground = False
+        self._hash = hash((Var, self.name))
+    def __eq__(self, other):
+        return self is other or (other.__class__ is Var and self.name == other.name)
+    __hash__ = Term.__hash__ # defining __eq__ resets __hash__
+    def __reduce__(self):
+        return (Var, (self.name,))
+    def __str__(self):
+        return self.name
+
+    def substitute(self, bindings):
+        return bindings.get(self.name, self)
+    def map_vars(self, function):
+        return function(self)
+
+class Num(Term):
+    __slots__ = ("value",)
+    _table: Dict[int, "Num"] = {}
+    def __new__(cls, value: int):
+        term = cls._table.get(value)
+        if term is None:
+            term = object.__new__(cls)
+            term.value = value
+            term.ground = True
+            term._hash = hash((Num, value))
+            cls._table[value] = term
+        return term
+    # Interned: identity is equality (default __eq__)
+    def __reduce__(self):
+        return (Num, (self.value,))
+    def __str__(self):
+        return str(self.value)
+
+    def substitute(self, bindings):
+        return self
+    def map_vars(self, function):
+        return self
+
+class Str(Term):
+    __slots__ = ("value", "_number")
+    _table: Dict[str, "Str"] = {}
+    def __new__(cls, value: str):
+        term = cls._table.get(value)
+        if term is None:
+            term = object.__new__(cls)
+            term.value = value
+            term._number = _UNKNOWN # see `numeric_value`
+            term.ground = True
+            term._hash = hash((Str, value))
+            cls._table[value] = term
+        return term
+    def __reduce__(self):
+        return (Str, (self.value,))
+    def __str__(self):
+        escaped = self.value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        return f'"{escaped}"'
+
+    def substitute(self, bindings):
+        return self
+    def map_vars(self, function):
+        return self
+
+class Func(Term):
+    # Function term / constant (nullary function); name "" is a tuple
+    __slots__ = ("name", "args")
+    _table: Dict[str, "Func"] = {} # nullary functions (constants)
+    def __new__(cls, name: str, args: Tuple[Term, ...] = ()):
+        if len(args) == 0:
+            term = cls._table.get(name)
+            if term is None:
+                term = object.__new__(cls)
+                term.name = sys.intern(name)
+                term.args = ()
+                term.ground = True
+                term._hash = hash((Func, term.name))
+                cls._table[name] = term
+            return term
+        term = object.__new__(cls)
+        term.name = sys.intern(name)
+        term.args = args
+        term.ground = all(arg.ground for arg in args)
+        term._hash = hash((Func, term.name, args))
+        return term
+    def __eq__(self, other):
+        return self is other or (
+            other.__class__ is Func and self._hash == other._hash and self.name == other.name and self.args == other.args
+        )
+    __hash__ = Term.__hash__ # defining __eq__ resets __hash__
+    def __reduce__(self):
+        return (Func, (self.name, self.args))
+    def __str__(self):
+        if len(self.args) == 0:
+            return "()" if self.name == "" else self.name
+        args = ",".join(str(arg) for arg in self.args)
+        if self.name == "":
+            return f"({args},)" if len(self.args) == 1 else f"({args})"
+        return f"{self.name}({args})"
+
+    def substitute(self, bindings):
+        if self.ground:
+            return self
+        return Func(self.name, tuple(arg.substitute(bindings) for arg in self.args))
+    def map_vars(self, function):
+        if self.ground:
+            return self
+        return Func(self.name, tuple(arg.map_vars(function) for arg in self.args))
+
+class UnaryOp(Term):
+    # op: "-" (also used for classical negation), "~", "|" (absolute)
+    __slots__ = ("op", "arg")
+    def __init__(self, op: str, arg: Term):
+        self.op = op
+        self.arg = arg
+        self.ground = arg.ground
+        self._hash = hash((UnaryOp, op, arg))
+    def __eq__(self, other):
+        return self is other or (
+            other.__class__ is UnaryOp and self._hash == other._hash and self.op == other.op and self.arg == other.arg
+        )
+    __hash__ = Term.__hash__ # defining __eq__ resets __hash__
+    def __reduce__(self):
+        return (UnaryOp, (self.op, self.arg))
+    def __str__(self):
+        if self.op == "|":
+            return f"|{self.arg}|"
+        return f"{self.op}{self.arg}"
+
+    def substitute(self, bindings):
+        if self.ground:
+            return self
+        return unary_operation(self.op, self.arg.substitute(bindings))
+    def map_vars(self, function):
+        if self.ground:
+            return self
+        return unary_operation(self.op, self.arg.map_vars(function))
+
+class BinaryOp(Term):
+    # op: arithmetic operators in `BINARY_OPERATOR`, or ".." for intervals
+    __slots__ = ("op", "left", "right")
+    def __init__(self, op: str, left: Term, right: Term):
+        self.op = op
+        self.left = left
+        self.right = right
+        self.ground = left.ground and right.ground
+        self._hash = hash((BinaryOp, op, left, right))
+    def __eq__(self, other):
+        return self is other or (
+            other.__class__ is BinaryOp and self._hash == other._hash and self.op == other.op
+            and self.left == other.left and self.right == other.right
+        )
+    __hash__ = Term.__hash__ # defining __eq__ resets __hash__
+    def __reduce__(self):
+        return (BinaryOp, (self.op, self.left, self.right))
+    def __str__(self):
+        return f"({self.left}{self.op}{self.right})"
+
+    def substitute(self, bindings):
+        if self.ground:
+            return self
+        return binary_operation(self.op, self.left.substitute(bindings), self.right.substitute(bindings))
+    def map_vars(self, function):
+        if self.ground:
+            return self
+        return binary_operation(self.op, self.left.map_vars(function), self.right.map_vars(function))
+
+class TermPool(Term):
+    # a;b (only kept for printing; rules are unpooled by preprocessing)
+    __slots__ = ("args",)
+    def __init__(self, args: Tuple[Term, ...]):
+        self.args = args
+        self.ground = all(arg.ground for arg in args)
+        self._hash = hash((TermPool, args))
+    def __eq__(self, other):
+        return self is other or (other.__class__ is TermPool and self.args == other.args)
+    __hash__ = Term.__hash__ # defining __eq__ resets __hash__
+    def __reduce__(self):
+        return (TermPool, (self.args,))
+    def __str__(self):
+        return ";".join(str(arg) for arg in self.args)
+
+    def substitute(self, bindings):
+        if self.ground:
+            return self
+        return TermPool(tuple(arg.substitute(bindings) for arg in self.args))
+    def map_vars(self, function):
+        if self.ground:
+            return self
+        return TermPool(tuple(arg.map_vars(function) for arg in self.args))
+
+##### Atoms #####
+# Symbolic atoms are plain terms (Func, or UnaryOp("-", Func) for classical negation).
+
+class Cmp(Term):
+    # left (op) right; `test` compares the values of ordering comparisons (see `numeric_value`)
+    __slots__ = ("op", "left", "right", "test")
+    def __init__(self, op: str, left: Term, right: Term):
+        self.op = op
+        self.test = COMPARISON.get(op)
+        self.left = left
+        self.right = right
+        self.ground = left.ground and right.ground
+        self._hash = hash((Cmp, op, left, right))
+    def __eq__(self, other):
+        return self is other or (
+            other.__class__ is Cmp and self._hash == other._hash and self.op == other.op
+            and self.left == other.left and self.right == other.right
+        )
+    __hash__ = Term.__hash__ # defining __eq__ resets __hash__
+    def __reduce__(self):
+        return (Cmp, (self.op, self.left, self.right))
+    def __str__(self):
+        return f"{self.left} {self.op} {self.right}"
+
+    def substitute(self, bindings):
+        if self.ground:
+            return self
+        return Cmp(self.op, self.left.substitute(bindings), self.right.substitute(bindings))
+    def map_vars(self, function):
+        if self.ground:
+            return self
+        return Cmp(self.op, self.left.map_vars(function), self.right.map_vars(function))
+
+class BoolConst(Term):
+    __slots__ = ("value",)
+    _table: Dict[bool, "BoolConst"] = {}
+    def __new__(cls, value: bool):
+        value = bool(value)
+        term = cls._table.get(value)
+        if term is None:
+            term = object.__new__(cls)
+            term.value = value
+            term.ground = True
+            term._hash = hash((BoolConst, value))
+            cls._table[value] = term
+        return term
+    def __reduce__(self):
+        return (BoolConst, (self.value,))
+    def __str__(self):
+        return "#true" if self.value else "#false"
+
+    def substitute(self, bindings):
+        return self
+    def map_vars(self, function):
+        return self
+
+class Agg(Term):
+    # (left_guard) { elements } (right_guard), where guards are (op, term) or None
+    __slots__ = ("elements", "left_guard", "right_guard")
+    def __init__(self, elements: Tuple["Lit", ...], left_guard: Optional[Tuple[str, Term]], right_guard: Optional[Tuple[str, Term]]):
+        self.elements = elements
+        self.left_guard = left_guard
+        self.right_guard = right_guard
+        self.ground = all(element.ground for element in elements) \
+            and (left_guard is None or left_guard[1].ground) \
+            and (right_guard is None or right_guard[1].ground)
+        self._hash = hash((Agg, elements, left_guard, right_guard))
+    def __eq__(self, other):
+        return self is other or (
+            other.__class__ is Agg and self._hash == other._hash and self.elements == other.elements
+            and self.left_guard == other.left_guard and self.right_guard == other.right_guard
+        )
+    __hash__ = Term.__hash__ # defining __eq__ resets __hash__
+    def __reduce__(self):
+        return (Agg, (self.elements, self.left_guard, self.right_guard))
+    def __str__(self):
+        string = "{ " + "; ".join(str(element) for element in self.elements) + " }"
+        if self.left_guard is not None:
+            string = f"{self.left_guard[1]} {self.left_guard[0]} " + string
+        if self.right_guard is not None:
+            string = string + f" {self.right_guard[0]} {self.right_guard[1]}"
+        return string
+
+    def _map_guard(self, guard, function):
+        return None if guard is None else (guard[0], function(guard[1]))
+    def substitute(self, bindings):
+        if self.ground:
+            return self
+        function = lambda t: t.substitute(bindings)
+        return Agg(
+            tuple(element.substitute(bindings) for element in self.elements),
+            self._map_guard(self.left_guard, function),
+            self._map_guard(self.right_guard, function)
+        )
+    def map_vars(self, function):
+        if self.ground:
+            return self
+        _function = lambda t: t.map_vars(function)
+        return Agg(
+            tuple(element.map_vars(function) for element in self.elements),
+            self._map_guard(self.left_guard, _function),
+            self._map_guard(self.right_guard, _function)
+        )
+
+##### Arithmetic #####
+
+_UNKNOWN = object()
+
+def numeric_value(term: Term) -> Optional[int]:
+    """Integer value of a number, or of a numeric string with a unit (converted as in preprocessing,
+    e.g. `"3 km"`); None for other terms."""
+    cls = term.__class__
+    if cls is Num:
+        return term.value
+    elif cls is Str:
+        number = term._number
+        if number is _UNKNOWN:
+            from .utils import convert_numeric_string_to_int
+            number = convert_numeric_string_to_int(term.value)
+            number = term._number = number if isinstance(number, int) else None # once per (interned) string
+        return number
+    return None
+
+def _divide(left: int, right: int) -> Optional[int]:
+    # Rounds toward zero, as clingo; undefined for 0
+    if right == 0:
+        return None
+    quotient = abs(left) // abs(right)
+    return quotient if (left >= 0) == (right > 0) else -quotient
+
+def _modulo(left: int, right: int) -> Optional[int]:
+    if right == 0:
+        return None
+    return left - right * _divide(left, right)
+
+def _power(left: int, right: int) -> Optional[int]:
+    return left ** right if right >= 0 else None
+
+# Operator -> function of the operand values (None: undefined, the term is kept as it is)
+ARITHMETIC: Dict[str, Callable[[int, int], Optional[int]]] = {
+    "+": operator.add, "-": operator.sub, "*": operator.mul, "/": _divide, "\\": _modulo, "**": _power,
+    "&": operator.and_, "?": operator.or_, "^": operator.xor,
+}
+UNARY_ARITHMETIC: Dict[str, Callable[[int], int]] = {"-": operator.neg, "~": operator.invert, "|": abs}
+COMPARISON: Dict[str, Callable[[int, int], bool]] = {
+    ">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le,
+}
+
+def binary_operation(op: str, left: Term, right: Term) -> Term:
+    """`left op right`, evaluated to a number once both operands are numbers (a `BinaryOp` until then)."""
+    function = ARITHMETIC.get(op)
+    if function is not None and left.ground and right.ground:
+        left_value = numeric_value(left)
+        right_value = numeric_value(right)
+        if left_value is not None and right_value is not None:
+            value = function(left_value, right_value)
+            if value is not None:
+                return Num(value)
+    return BinaryOp(op, left, right)
+
+def unary_operation(op: str, arg: Term) -> Term:
+    """`op arg`, evaluated to a number for a number `arg` (`-a` of a function is a classical negation)."""
+    if arg.ground:
+        value = numeric_value(arg)
+        if value is not None:
+            return Num(UNARY_ARITHMETIC[op](value))
+    return UnaryOp(op, arg)
+
+##### Literals and rules #####
+
+class Lit(Term):
+    # sign: 0 (no sign), 1 (`not`), 2 (`not not`); same values as `clingo.ast.Sign`
+    __slots__ = ("sign", "atom")
+    def __init__(self, sign: int, atom: Term):
+        self.sign = int(sign)
+        self.atom = atom
+        self.ground = atom.ground
+        self._hash = hash((Lit, self.sign, atom))
+    def __eq__(self, other):
+        return self is other or (
+            other.__class__ is Lit and self._hash == other._hash and self.sign == other.sign and self.atom == other.atom
+        )
+    __hash__ = Term.__hash__ # defining __eq__ resets __hash__
+    def __reduce__(self):
+        return (Lit, (self.sign, self.atom))
+    def __str__(self):
+        return "not " * self.sign + str(self.atom)
+
+    def substitute(self, bindings):
+        if self.ground:
+            return self
+        return Lit(self.sign, self.atom.substitute(bindings))
+    def map_vars(self, function):
+        if self.ground:
+            return self
+        return Lit(self.sign, self.atom.map_vars(function))
+
+class Clause(Term):
+    # head :- body.
+    __slots__ = ("head", "body")
+    def __init__(self, head: Lit, body: Tuple[Lit, ...]):
+        self.head = head
+        self.body = body
+        self.ground = head.ground and all(lit.ground for lit in body)
+        self._hash = hash((Clause, head, body))
+    def __eq__(self, other):
+        return self is other or (
+            other.__class__ is Clause and self._hash == other._hash and self.head == other.head and self.body == other.body
+        )
+    __hash__ = Term.__hash__ # defining __eq__ resets __hash__
+    def __reduce__(self):
+        return (Clause, (self.head, self.body))
+    def __str__(self):
+        if len(self.body) == 0:
+            return f"{self.head}."
+        return f"{self.head} :- " + "; ".join(str(lit) for lit in self.body) + "."
+
+    def substitute(self, bindings):
+        if self.ground:
+            return self
+        return Clause(self.head.substitute(bindings), tuple(lit.substitute(bindings) for lit in self.body))
+    def map_vars(self, function):
+        if self.ground:
+            return self
+        return Clause(self.head.map_vars(function), tuple(lit.map_vars(function) for lit in self.body))
+
+##### Rule templates #####
+
+class RuleTemplate():
+    """A rule compiled once for renaming apart.
+
+    Every variable occurrence is replaced by a numbered slot (each anonymous `_` gets its own slot),
+    so renaming for a rule application is a single structural copy (`instantiate`) without parsing.
+    Ground rules are never copied.
+    """
+    __slots__ = ("rule", "slots", "prefixes", "suffixes")
+
+    def __init__(self, rule: Clause):
+        slot_of: Dict[str, Var] = {}
+        prefixes = []
+        suffixes = []
+        anonym_idx = 0
+        def number(var: Var) -> Var:
+            nonlocal anonym_idx
+            if var.name == "_":
+                slot = Var(f"#{len(prefixes)}")
+                prefixes.append("_Anon_")
+                suffixes.append(f"_{anonym_idx}")
+                anonym_idx += 1
+                return slot
+            slot = slot_of.get(var.name)
+            if slot is None:
+                slot = slot_of[var.name] = Var(f"#{len(prefixes)}")
+                prefixes.append(f"{var.name}_")
+                suffixes.append("")
+            return slot
+        self.rule: Clause = rule.map_vars(number)
+        self.slots: Tuple[str, ...] = tuple(f"#{i}" for i in range(len(prefixes)))
+        self.prefixes: Tuple[str, ...] = tuple(prefixes)
+        self.suffixes: Tuple[str, ...] = tuple(suffixes)
+
+    def instantiate(self, index: int) -> Clause:
+        """Copy of the rule with fresh variables: `X` -> `X_{index}`, the n-th `_` -> `_Anon_{index}_{n}`."""
+        if self.rule.ground:
+            return self.rule
+        index = str(index)
+        return self.rule.substitute({
+            slot: Var(prefix + index + suffix)
+            for slot, prefix, suffix in zip(self.slots, self.prefixes, self.suffixes)
+        })
+
+##### Conversion from clingo AST #####
+
+def symbol_to_term(symbol: Symbol) -> Term:
+    if symbol.type == SymbolType.Number:
+        return Num(symbol.number)
+    elif symbol.type == SymbolType.String:
+        return Str(symbol.string)
+    elif symbol.type == SymbolType.Function:
+        term = Func(symbol.name, tuple(symbol_to_term(arg) for arg in symbol.arguments))
+        if symbol.negative:
+            term = UnaryOp("-", term)
+        return term
+    elif symbol.type == SymbolType.Infimum:
+        return Func("#inf")
+    elif symbol.type == SymbolType.Supremum:
+        return Func("#sup")
+    raise ValueError(f"Unsupported symbol {symbol}")
+
+def _guard_to_term(guard):
+    if guard is None:
+        return None
+    return (COMPARISON_OPERATOR[guard.comparison], to_term(guard.term))
+
+def to_term(ast: AST) -> Term:
+    """Convert clingo AST (rule, literal, atom or term) to an immutable term.
+    Raises ValueError for constructs the solver does not support."""
+    ast_type = ast.ast_type
+    # Terms
+    if ast_type == ASTType.Variable:
+        return Var(ast.name)
+    elif ast_type == ASTType.SymbolicTerm:
+        return symbol_to_term(ast.symbol)
+    elif ast_type == ASTType.Function:
+        name = "@" + ast.name if ast.external else ast.name
+        return Func(name, tuple(to_term(arg) for arg in ast.arguments))
+    elif ast_type == ASTType.UnaryOperation:
+        return unary_operation(UNARY_OPERATOR[ast.operator_type], to_term(ast.argument))
+    elif ast_type == ASTType.BinaryOperation:
+        return binary_operation(BINARY_OPERATOR[ast.operator_type], to_term(ast.left), to_term(ast.right))
+    elif ast_type == ASTType.Interval:
+        return BinaryOp("..", to_term(ast.left), to_term(ast.right))
+    elif ast_type == ASTType.Pool:
+        return TermPool(tuple(to_term(arg) for arg in ast.arguments))
+    # Atoms
+    elif ast_type == ASTType.SymbolicAtom:
+        return to_term(ast.symbol)
+    elif ast_type == ASTType.Comparison:
+        if len(ast.guards) != 1:
+            raise ValueError(f"Comparison chains are not supported: {str(ast)}")
+        guard = ast.guards[0]
+        return Cmp(COMPARISON_OPERATOR[guard.comparison], to_term(ast.term), to_term(guard.term))
+    elif ast_type == ASTType.BooleanConstant:
+        return BoolConst(ast.value)
+    elif ast_type == ASTType.Aggregate:
+        return Agg(
+            tuple(to_term(element.literal) for element in ast.elements),
+            _guard_to_term(ast.left_guard),
+            _guard_to_term(ast.right_guard)
+        )
+    # Literals and rules
+    elif ast_type == ASTType.Literal:
+        return Lit(ast.sign, to_term(ast.atom))
+    elif ast_type == ASTType.Rule:
+        if ast.head.ast_type != ASTType.Literal:
+            raise ValueError("All rule heads must be non-conditional simple literals")
+        return Clause(to_term(ast.head), tuple(to_term(lit) for lit in ast.body))
+    raise ValueError(f"Unsupported AST type {ast_type}")
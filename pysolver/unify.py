@@ -1,146 +1,202 @@
-from typing import Dict
-from copy import deepcopy
-from functools import lru_cache
-
-from clingo.ast import *
-from clingo.control import *
-from clingo.symbol import *
-from clingo.solving import *
-
-def find_bindings(ast1: AST, ast2: AST):
-    # Entry for _unify, actual recursive function
-    # perform initial deepcopy
-    ast1 = deepcopy(ast1)
-    ast2 = deepcopy(ast2)
-    return _find_bindings(ast1, ast2)
-
-@lru_cache(maxsize=1024) # optimization
-def _find_bindings(ast1: AST, ast2: AST):
-    # Variable
-    if ast1.ast_type == ast2.ast_type == ASTType.Variable:
-        return {ast1.name: ast2} # FIXME??
-        # raise ValueError("Unification failed; two variables cannot be unified")
-    elif ast1.ast_type == ASTType.Variable:
-        return {ast1.name: ast2}
-    elif ast2.ast_type == ASTType.Variable:
-        return {ast2.name: ast1}
-    
-    # SymbolicAtom
-    elif ast1.ast_type == ast2.ast_type == ASTType.SymbolicAtom:
-        return _find_bindings(ast1.symbol, ast2.symbol)
-
-    # SymbolicTerm
-    elif ast1.ast_type == ast2.ast_type == ASTType.SymbolicTerm:
-        if ast1.symbol == ast2.symbol:
-            return {}
-        else:
-            return None
+from typing import Dict, List, Tuple, Optional
 
-    # UnaryOperation
-    elif ast1.ast_type == ast2.ast_type == ASTType.UnaryOperation:
-        if ast1.operator_type == ast2.operator_type:
-            bindings = _find_bindings(ast1.argument, ast2.argument)
-            return bindings
-        else:
-            return None
-    
-    # BinaryOperation
-    elif ast1.ast_type == ast2.ast_type == ASTType.BinaryOperation:
-        # Deepcopy because substitution is required for correct behavior
-        ast1 = deepcopy(ast1); ast2 = deepcopy(ast2)
-        if ast1.operator_type == ast2.operator_type:
-            bindings = _find_bindings(ast1.left, ast2.left)
-            if bindings is None:
-                return None
-            bind(ast1, bindings)
-            bind(ast2, bindings)
-            bindings.update(_find_bindings(ast1.right, ast2.right))
-            return bindings
-        else:
-            return None
-    
-    # Function
-    elif ast1.ast_type == ast2.ast_type == ASTType.Function:
-        # Deepcopy because substitution is required for correct behavior
-        ast1 = deepcopy(ast1); ast2 = deepcopy(ast2)
-        if ast1.name == ast2.name and len(ast1.arguments) == len(ast2.arguments):
-            bindings = {}
-            for i in range(len(ast1.arguments)):
-                arg1 = ast1.arguments[i]
-                arg2 = ast2.arguments[i]
-                args_binding = _find_bindings(arg1, arg2)
-                if args_binding is None:
-                    # one of args do not unify
-                    return None
-                bind(ast1, dict(args_binding))
-                bind(ast2, dict(args_binding))
-                bindings.update(args_binding)
-            return bindings
-        else:
-            return None
-    
-    
-    # Literal
-    elif ast1.ast_type == ast2.ast_type == ASTType.Literal:
-        if ast1.sign == ast2.sign and ast1.atom.ast_type == ast2.atom.ast_type:
-            return _find_bindings(ast1.atom, ast2.atom)
-    # Boolean constant
-    elif ast1.ast_type == ast2.ast_type == ASTType.BooleanConstant:
-        if ast1.value == ast2.value:
-            return {}
-        else:
+from clingo.ast import AST
+
+from .term import Term, Var, Num, Func, UnaryOp, BinaryOp, TermPool, Cmp, Agg, Lit, to_term
+
+class Substitution():
+    """Variable bindings with a trail.
+
+    Bindings are recorded in a single store (name -> term) instead of being substituted into copies of the terms.
+    Every binding is pushed on the trail, so the search can backtrack with `undo(mark)`.
+    Bound variables are followed by `deref`; `resolve` builds the fully instantiated term only when needed.
+    """
+    __slots__ = ("bindings", "trail", "deferred")
+
+    def __init__(self):
+        self.bindings: Dict[str, Term] = {}
+        self.trail: List[str] = []
+        self.deferred: Optional[List[Tuple[Term, Term]]] = None # see `unify_deferring`
+
+    def mark(self) -> int:
+        return len(self.trail)
+
+    def undo(self, mark: int) -> None:
+        trail = self.trail
+        bindings = self.bindings
+        while len(trail) > mark:
+            del bindings[trail.pop()]
+
+    def deref(self, term: Term) -> Term:
+        bindings = self.bindings
+        while term.__class__ is Var:
+            value = bindings.get(term.name)
+            if value is None:
+                return term
+            term = value
+        return term
+
+    def bind(self, var: Var, term: Term) -> None:
+        self.bindings[var.name] = term
+        self.trail.append(var.name)
+
+    def unify(self, term1: Term, term2: Term) -> bool:
+        """Unify two terms under the current bindings. On failure, partial bindings are undone."""
+        mark = len(self.trail)
+        if self._unify(term1, term2):
+            return True
+        self.undo(mark)
+        return False
+
+    def unify_deferring(self, term1: Term, term2: Term) -> Optional[List[Tuple[Term, Term]]]:
+        """`unify`, where a number and an arithmetic term that is not ground yet (`14` and `D*7`) unify on condition
+        that they are equal once evaluated. Returns these conditions (pairs of terms), or None on failure."""
+        self.deferred = []
+        try:
+            if self.unify(term1, term2):
+                return self.deferred
             return None
-    elif ast1.ast_type == ast2.ast_type == ASTType.Comparison:
-        return {} # FIXME
+        finally:
+            self.deferred = None
+
+    def resolve(self, term: Term) -> Term:
+        """Apply all bindings to `term`."""
+        if term.ground or len(self.bindings) == 0:
+            return term
+        return term.map_vars(self._resolve_var)
+
+    def to_dict(self) -> Dict[str, Term]:
+        """Fully resolved bindings, in the form returned by `find_bindings`."""
+        return {name: self.resolve(value) for name, value in self.bindings.items()}
+
+    def _resolve_var(self, var: Var) -> Term:
+        term = self.deref(var)
+        if term.ground or term.__class__ is Var:
+            return term
+        return term.map_vars(self._resolve_var)
+
+    def _occurs(self, var: Var, term: Term) -> bool:
+        term = self.deref(term)
+        if term.ground:
+            return False
+        if term.__class__ is Var:
+            return term.name == var.name
+        found = []
+        term.map_vars(lambda v: found.append(v) or v)
+        return any(self._occurs(var, v) for v in found)
+
+    def _unify(self, term1: Term, term2: Term) -> bool:
+        if term1.__class__ is Var:
+            term1 = self.deref(term1)
+        if term2.__class__ is Var:
+            term2 = self.deref(term2)
+        if term1 is term2:
+            return True
+        cls1 = term1.__class__
+        cls2 = term2.__class__
+
+        # Variable
+        if cls1 is Var:
+            if cls2 is Var:
+                if term1.name != term2.name:
+                    self.bind(term1, term2)
+                return True
+            if not term2.ground and self._occurs(term1, term2):
+                return False
+            self.bind(term1, term2)
+            return True
+        elif cls2 is Var:
+            if not term1.ground and self._occurs(term2, term1):
+                return False
+            self.bind(term2, term1)
+            return True
+        elif cls1 is not cls2:
+            # `-X` and a number: X is the negated number (ground arithmetic is evaluated, see `term.unary_operation`)
+            if cls1 is Num and cls2 is UnaryOp and term2.op == "-":
+                return self._unify(Num(-term1.value), term2.arg)
+            elif cls2 is Num and cls1 is UnaryOp and term1.op == "-":
+                return self._unify(term1.arg, Num(-term2.value))
+            elif self.deferred is not None and (
+                cls1 is Num and (cls2 is BinaryOp or cls2 is UnaryOp) and not term2.ground
+                or cls2 is Num and (cls1 is BinaryOp or cls1 is UnaryOp) and not term1.ground
+            ):
+                self.deferred.append((term1, term2))
+                return True
+            return False
+        # Ground terms are hash-consed / hashed: compare directly
+        elif term1.ground and term2.ground:
+            return term1 == term2
+
+        # Function
+        elif cls1 is Func:
+            if term1.name != term2.name or len(term1.args) != len(term2.args):
+                return False
+            for arg1, arg2 in zip(term1.args, term2.args):
+                if not self._unify(arg1, arg2):
+                    return False
+            return True
+        # Literal
+        elif cls1 is Lit:
+            return term1.sign == term2.sign and self._unify(term1.atom, term2.atom)
+        # UnaryOperation
+        elif cls1 is UnaryOp:
+            return term1.op == term2.op and self._unify(term1.arg, term2.arg)
+        # BinaryOperation, Comparison (structural)
+        elif cls1 is BinaryOp or cls1 is Cmp:
+            return term1.op == term2.op \
+                and self._unify(term1.left, term2.left) \
+                and self._unify(term1.right, term2.right)
+        # Pool
+        elif cls1 is TermPool:
+            if len(term1.args) != len(term2.args):
+                return False
+            for arg1, arg2 in zip(term1.args, term2.args):
+                if not self._unify(arg1, arg2):
+                    return False
+            return True
+        # Aggregate (structural: elements pairwise, then guards)
+        elif cls1 is Agg:
+            if len(term1.elements) != len(term2.elements):
+                return False
+            for element1, element2 in zip(term1.elements, term2.elements):
+                if not self._unify(element1, element2):
+                    return False
+            return self._unify_guard(term1.left_guard, term2.left_guard) \
+                and self._unify_guard(term1.right_guard, term2.right_guard)
+
+        return term1 == term2
+
+    def _unify_guard(self, guard1, guard2) -> bool:
+        if guard1 is None or guard2 is None:
+            return guard1 is guard2
+        return guard1[0] == guard2[0] and self._unify(guard1[1], guard2[1])
+
+def unifiable(term1: Term, term2: Term, defer_arithmetic: bool = False) -> bool:
+    """Check if two terms unify, without building any bindings or terms.
+    With `defer_arithmetic`, numbers unify with arithmetic terms that are not ground yet (see `Substitution.unify_deferring`)."""
+    if term1.ground and term2.ground:
+        return term1 == term2
+    substitution = Substitution()
+    if defer_arithmetic:
+        substitution.deferred = []
+    return substitution._unify(term1, term2)
 
-    return None
+def find_bindings(term1: Term, term2: Term) -> Optional[Dict[str, Term]]:
+    """Unify two terms and return the variable bindings (name -> term), or None if they do not unify.
+    Variables on either side may be bound; a variable on the left is bound to the right-hand side first.
+    Clingo ASTs are accepted for convenience and converted to terms.
+    """
+    if isinstance(term1, AST):
+        term1 = to_term(term1)
+    if isinstance(term2, AST):
+        term2 = to_term(term2)
+    substitution = Substitution()
+    if not substitution._unify(term1, term2):
+        return None
+    return substitution.to_dict()
 
-def bind(input_ast, bindings: Dict[str, AST]):
-    # Explicit call stack maintaining for a bit of speedup
+def bind(term: Term, bindings: Dict[str, Term]) -> Term:
+    """Apply bindings to `term`. Terms are immutable, so a new term is returned."""
     if len(bindings) == 0:
-        return input_ast
-    stack = [input_ast]
-
-    while len(stack) > 0:
-        ast = stack.pop()
-        child_keys = set(ast.child_keys)
-        if "atom" in child_keys:
-            stack.append(ast.atom)
-        if "arguments" in child_keys:
-            for i, arg in enumerate(ast.arguments):
-                if arg.ast_type == ASTType.Variable and arg.name in bindings:
-                    ast.arguments[i] = bindings[arg.name]
-                else:
-                    stack.append(arg)
-        if "left" in child_keys:
-            if ast.left.ast_type == ASTType.Variable and ast.left.name in bindings:
-                ast.left = bindings[ast.left.name]
-            else:
-                stack.append(ast.left)
-        if "right" in child_keys:
-            if ast.right.ast_type == ASTType.Variable and ast.right.name in bindings:
-                ast.right = bindings[ast.right.name]
-            else:
-                stack.append(ast.right)
-        if "argument" in child_keys:
-            if ast.argument.ast_type == ASTType.Variable and ast.argument.name in bindings:
-                ast.argument = bindings[ast.argument.name]
-            else:
-                stack.append(ast.argument)
-        if "symbol" in child_keys:
-            if ast.symbol.ast_type == ASTType.Variable and ast.symbol.name in bindings:
-                ast.symbol = bindings[ast.symbol.name]
-            else:
-                stack.append(ast.symbol)
-        if "term" in child_keys:
-            if ast.term.ast_type == ASTType.Variable and ast.term.name in bindings:
-                ast.term = bindings[ast.term.name]
-            else:
-                stack.append(ast.term)
-        if "guards" in child_keys:
-            for i, arg in enumerate(ast.guards):
-                arg = arg.term
-                if arg.ast_type == ASTType.Variable and arg.name in bindings:
-                    ast.guards[i].term = bindings[arg.name]
-                else:
-                    stack.append(arg)
\ No newline at end of file
+        return term
+    return term.substitute(bindings)
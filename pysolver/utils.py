@@ -4,6 +4,8 @@ from clingo.symbol import *
 import re
 from enum import Enum
 
+from .term import Term, Lit, Clause, Func, UnaryOp, BoolConst
+
 UNIT_FACTOR = {
     # Numeric units
     "%" : 1000,
@@ -62,6 +64,8 @@ def convert_numeric_string_to_int(input_string):
         return input_string
 
 def get_hash_head(ast:AST):
+    if isinstance(ast, Term):
+        return _get_hash_head_term(ast)
     rule_str = str(ast)
     # Hash by head symbol (rule base..^^)
     # not a(..) :-   =>    `not a`
@@ -75,13 +79,34 @@ def get_hash_head(ast:AST):
     hash_head = rule_str[:index].strip()
     return hash_head
 
+def _get_hash_head_term(term: Term):
+    # Same keys as `get_hash_head`, computed from the term structure instead of the string
+    if term.__class__ is Clause:
+        term = term.head
+    if term.__class__ is not Lit:
+        return str(term)
+    atom = term.atom
+    prefix = "not " * term.sign
+    if atom.__class__ is UnaryOp and atom.op == "-" and atom.arg.__class__ is Func:
+        prefix += "-"
+        atom = atom.arg
+    if atom.__class__ is Func or atom.__class__ is BoolConst:
+        return prefix + (atom.name if atom.__class__ is Func else str(atom))
+    return str(term)
+
 def is_negated(ast: AST) -> bool:
+    if isinstance(ast, Term):
+        if ast.__class__ is not Lit:
+            raise ValueError(f"Term {str(ast)} is not Literal; thus cannot be negated")
+        return ast.sign == Sign.Negation
     if ast.ast_type != ASTType.Literal:
         raise ValueError(f"AST {str(ast)} is not Literal; thus cannot be negated")
     return ast.sign == Sign.Negation
 
 def is_ground(ast: AST) -> bool:
     # Only true if no variables are inside this ast.
+    if isinstance(ast, Term):
+        return ast.ground # precomputed
     if ast.ast_type == ASTType.Variable:
         return False
     
@@ -111,6 +136,13 @@ def is_ground(ast: AST) -> bool:
     return grounded
 
 def flip_sign(ast):
+    if isinstance(ast, Term):
+        if ast.sign == Sign.Negation:
+            return Lit(Sign.NoSign, ast.atom)
+        elif ast.sign == Sign.NoSign:
+            return Lit(Sign.Negation, ast.atom)
+        else:
+            raise ValueError("Does not support DoubleNegation")
     new_ast = deepcopy(ast)
     if ast.sign == Sign.Negation:
         new_ast.sign = Sign.NoSign
@@ -120,8 +152,10 @@ def flip_sign(ast):
         raise ValueError("Does not support DoubleNegation")
     return new_ast
 
+_VARIABLE = re.compile(r"([,( ])(_*[A-Z][A-Za-z_0-9]*)(?=[,)]| [+\-*/%><=!])")
+
 def anonymize_vars(goal_str):
-    return re.sub(r"([,( ])(_*[A-Z][A-Za-z_0-9]*)(?=[,)]| [+\-*/%><=!])", "\g<1>_", goal_str) # Remove variables
+    return _VARIABLE.sub("\g<1>_", goal_str) # Remove variables
 
 def parse_line(goal: str):
     _temp = []
@@ -0,0 +1,11 @@
+import pytest
+
+api = pytest.importorskip("nl2logic.logic_utils.api") # needs the web app's dependencies
+
+def test_infinite_regress_is_reported_per_conclusion():
+    program = [{"asp": "p :- not q."}, {"asp": "q :- not p."}, {"asp": "r."}]
+    conclusions, _ = api.asp_parse_conclusion(["p", "r"])
+    result = api.asp_run(program, conclusions, output_style="text")
+    assert result["satisfactory"] == "Unsatisfied"
+    assert [(proof["conclusion"], proof["proved"]) for proof in result["proofs"]] == [("p", 0), ("r", 1)]
+    assert "Infinite regress" in result["proofs"][0]["tree"]
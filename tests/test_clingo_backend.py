@@ -0,0 +1,33 @@
+from pysolver import CompiledProgram
+from pysolver.clingo_backend import clingo_verdicts, dependent_predicates
+from pysolver.rule_cache import rule_cache
+from pysolver.rule_index import get_atom_key
+from pysolver.term import to_term
+from pysolver.utils import parse_line
+
+def _verdicts(lines, conclusions):
+    # As `asp_run(..., backend="clingo")`: preprocessed statements, predicates of dropped rules left undecided
+    program = CompiledProgram([{"asp": line} for line in lines])
+    statements = []
+    dropped = []
+    for line in lines:
+        parsed = rule_cache.get(line)
+        line_statements, complete = parsed.clingo
+        statements.extend(line_statements)
+        if not complete:
+            dropped.append(get_atom_key(parsed.terms[0].head.atom))
+    undecided = dependent_predicates(program.context.rule_index.rules, dropped)
+    goals = [to_term(parse_line(conclusion + ".").head) for conclusion in conclusions]
+    return clingo_verdicts(statements, goals, undecided=undecided)
+
+def test_aggregates_are_decided():
+    lines = ["s(X) :- 1 <= {q(X); c(X)}.", "t(X) :- z(X), not 1 <= {q(X); c(X)}.", "q(1).", "c(2).", "z(1).", "z(3)."]
+    assert _verdicts(lines, ["s(1)", "s(2)", "s(3)", "not s(3)", "t(1)", "t(3)"]) == [True, True, False, True, False, True]
+
+def test_unsafe_rule_only_undecides_its_dependents():
+    lines = ["fin(X) :- not a(X).", "g :- fin(1).", "a(1).", "b(X) :- a(X)."]
+    assert _verdicts(lines, ["fin(2)", "g", "b(1)", "b(2)"]) == [None, None, True, False]
+
+def test_numeric_strings_are_converted():
+    lines = ['f("3km").', "near(X) :- f(X), X < 5000000."]
+    assert _verdicts(lines, ["near(3000000)"]) == [True]
@@ -0,0 +1,11 @@
+from pysolver.rule_cache import RuleCache, normalize_rule
+
+def test_multiline_rule_with_comments():
+    cache = RuleCache()
+    parsed = cache.get('a :- b, % b holds\n  c. %* block\n comment *%')
+    assert str(parsed.ast) == "a :- b; c."
+    assert [str(rule) for rule in parsed.terms] == ["a :- b; c."]
+    assert cache.get("a :- b,\n  c.") is parsed
+
+def test_normalize_keeps_strings():
+    assert normalize_rule('p("a  %b") :-   q. % comment') == 'p("a  %b") :- q.'
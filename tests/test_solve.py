@@ -0,0 +1,14 @@
+from pysolver import CompiledProgram
+from pysolver.utils import parse_line
+
+def _answers(program, goal):
+    compiled = CompiledProgram([{"asp": line} for line in program])
+    return [str(proof.goal) for proof in compiled.solve(parse_line(goal + ".").head)]
+
+def test_arithmetic_head_called_with_a_number():
+    program = ["days(D*7) :- weeks(D).", "weeks(2).", "late :- days(14).", "early :- days(15)."]
+    assert _answers(program, "days(14)") == ["days(14)"]
+    assert _answers(program, "days(X)") == ["days(14)"]
+    assert _answers(program, "late") == ["late"]
+    assert _answers(program, "days(15)") == []
+    assert _answers(program, "not early") == ["not early"]
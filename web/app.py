@@ -23,7 +23,7 @@ def test_asp():
     data = request.get_json()
     case_id = data['courtname'] + '-' + data['casenum']
 
-    response_data = validity_check(data, mode="case")
+    response_data = validity_check(data, mode="case", output_style="json") # trees are drawn by the page
 
     ##### Return response #####
     response_data['database_message'] = ["DB에 업데이트하려면 'DB에 등록하기' 버튼을 사용해주세요."]
@@ -40,7 +40,7 @@ def update_case_db():
     data = request.get_json()
     case_id = data['courtname'] + '-' + data['casenum']
 
-    response_data = validity_check(data, mode="case")
+    response_data = validity_check(data, mode="case", output_style="json") # trees are drawn by the page
 
     ##### Update terms DB #####
     # Only update DB if validity check has been passed!!!!